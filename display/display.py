@@ -5,39 +5,196 @@ This part of the code exposes functions to interface with the eink display
 """
 
 import display.epd12in48b as eink
-from PIL import Image
+from display.framebuffer import FrameBuffer, FrameFile
+import json
 import logging
+import pathlib
 
 
 class DisplayHelper:
 
-    def __init__(self, width, height):
+    def __init__(self, width, height, busyWaitMode='poll', busySettleTime=0.2, backend=None, isPipelined=False,
+                 calibrationMaxRefreshes=7, calibrationMaxGhosting=1.0, fastRefreshMaxChange=0,
+                 fastRefreshMaxCount=5, stateDir=None):
         # Initialise the display
+        # stateDir is the folder of the files that outlive a run (last frame, calibration state), the display folder
+        # by default
         self.logger = logging.getLogger('maginkcal')
         self.screenwidth = width
         self.screenheight = height
+        self.currPath = str(pathlib.Path(__file__).parent.absolute())
+        stateDir = str(stateDir) if stateDir is not None else self.currPath
+        self.lastFrameFile = stateDir + '/lastframe.bin'  # frame file of what is currently shown on the panel
+        self.calibrationFile = stateDir + '/calibration.json'  # refreshes and ghosting since the last calibration
+        self.calibrationMaxRefreshes = calibrationMaxRefreshes
+        self.calibrationMaxGhosting = calibrationMaxGhosting
+        self.fastRefreshMaxChange = fastRefreshMaxChange  # fraction of pixels changed up to which fast refresh is used
+        self.fastRefreshMaxCount = fastRefreshMaxCount  # fast refreshes in a row before a full refresh is forced
+        if backend is not None:
+            eink.select_backend(backend)
         self.epd = eink.EPD()
-        self.epd.Init()
-
-    def update(self, blackimg, redimg):
-        # Updates the display with the grayscale and red images
-        # start displaying on eink display
-        # self.epd.clear()
-        self.epd.display(blackimg, redimg)
-        self.logger.info('E-Ink display update complete.')
-
-    def calibrate(self, cycles=1):
-        # Calibrates the display to prevent ghosting
-        white = Image.new('1', (self.screenwidth, self.screenheight), 'white')
-        black = Image.new('1', (self.screenwidth, self.screenheight), 'black')
+        self.epd.busyMode = busyWaitMode
+        self.epd.busySettleTime = busySettleTime
+        self.epd.isPipelined = isPipelined
+        self.isInitialised = False  # the panel is only woken up once there is something to send
+
+    def init_display(self, refreshMode='full'):
+        # Wakes the panel up with the LUTs of refreshMode, or switches to them if it is awake
+        if not self.isInitialised:
+            self.epd.Init(refreshMode)
+            self.isInitialised = True
+        else:
+            self.epd.SetLut(refreshMode)
+
+    def update(self, frame):
+        # Updates the display with the black and red planes of a FrameBuffer
+        # only the quadrants that differ from the frame last sent to the panel are transmitted and refreshed
+        frame = frame.fit(self.epd.width, self.epd.height)
+        quadrants, changeRatio = self.get_dirty_quadrants(frame)
+        if not quadrants:
+            self.logger.info('E-Ink display unchanged since last update, refresh skipped.')
+            return
+        state = self.load_calibration_state()
+        refreshMode = self.get_refresh_mode(changeRatio, state)
+        self.init_display(refreshMode)
+        self.epd.display_frame(frame, quadrants)
+        self.log_transfer_timings()
+        self.save_last_frame(frame)
+        self.record_refresh(state, changeRatio, refreshMode)
+        change = 'previous frame unknown' if changeRatio is None else '{:.1%} of pixels changed'.format(changeRatio)
+        self.logger.info('E-Ink display update complete. Refreshed: {} ({} refresh, {})'.format(
+            ', '.join(q[0] for q in quadrants), refreshMode, change))
+
+    def get_refresh_mode(self, changeRatio, state):
+        # The fast waveforms leave more ghosting behind, they are only used for small changes and a full refresh
+        # follows after fastRefreshMaxCount of them. They are off by default (fastRefreshMaxChange 0) until the fast
+        # LUTs have been checked on the panel
+        if (self.fastRefreshMaxChange > 0 and changeRatio is not None and changeRatio <= self.fastRefreshMaxChange and
+                state['fastRefreshes'] < self.fastRefreshMaxCount):
+            return 'fast'
+        return 'full'
+
+    def log_transfer_timings(self):
+        # wait is the time the SPI writer spent waiting for the quadrant to be packed, when pipelined packing
+        # keeps ahead of the transfers it is close to 0. Without pipelining the writer packs (or decodes) each plane
+        # itself and never waits
+        for name, timing in self.epd.timings.items():
+            if self.epd.isPipelined:
+                self.logger.info('Quadrant {}: packed in {:.1f}ms, sent in {:.1f}ms, waited {:.1f}ms for data.'.format(
+                    name, timing['pack'] * 1000, timing['send'] * 1000, timing['wait'] * 1000))
+            else:
+                self.logger.info('Quadrant {}: packed in {:.1f}ms, sent in {:.1f}ms.'.format(
+                    name, timing['pack'] * 1000, timing['send'] * 1000))
+
+    def get_dirty_quadrants(self, frame):
+        # Compares the new planes with the last frame sent, quadrant by quadrant
+        # Returns the quadrants that differ and the fraction of the panel's pixels that change colour, None when
+        # there is no last frame to compare with
+        # The planes are compared chunk by chunk, so an EncodedFrame is decoded one band at a time here too; its
+        # black and red bands cover the same rows, so each pair is compared with the same slice of the last frame
+        lastFrame = self.load_last_frame()
+        if lastFrame is None:
+            return eink.EPD_QUADRANTS, None
+        dirty = []
+        changedPixels = 0
+        with lastFrame:
+            for quadrant in eink.EPD_QUADRANTS:
+                blackChunks, redChunks = frame.iter_wire_planes(quadrant)
+                lastBlackData, lastRedData = lastFrame.get_wire_planes(quadrant)
+                isDirty = False
+                offset = 0
+                for blackData, redData in zip(blackChunks, redChunks):
+                    end = offset + len(blackData)
+                    lastBlackChunk, lastRedChunk = lastBlackData[offset:end], lastRedData[offset:end]
+                    if blackData != lastBlackChunk or redData != lastRedChunk:
+                        isDirty = True
+                        changedPixels += count_changed_pixels(blackData, lastBlackChunk, redData, lastRedChunk)
+                    offset = end
+                if isDirty:
+                    dirty.append(quadrant)
+        panelPixels = sum((q[2] - q[1]) * (q[4] - q[3]) * 8 for q in eink.EPD_QUADRANTS)
+        return tuple(dirty), changedPixels / panelPixels
+
+    def load_last_frame(self):
+        # Returns the FrameFile last sent to the panel, or None if there is no valid one
+        try:
+            return FrameFile(self.lastFrameFile)
+        except (OSError, ValueError):
+            return None
+
+    def save_last_frame(self, frame):
+        frame.save(self.lastFrameFile)
+
+    def repaint(self):
+        # Sends the last frame to the whole panel again, e.g. after calibrating or when the panel was interrupted
+        frame = self.load_last_frame()
+        if frame is None:
+            self.logger.info('No saved frame to repaint the E-Ink display with.')
+            return False
+        self.init_display()
+        self.epd.display_frame(frame)
+        self.logger.info('E-Ink display repainted with the last frame.')
+        return True
+
+    def calibrate(self, cycles=1, isRepainted=False):
+        # Calibrates the display to prevent ghosting, by filling it with black, red and white in turn
+        # isRepainted shows the last frame again afterwards, otherwise the panel is left white
+        if cycles > 0:
+            self.init_display('full')
         for _ in range(cycles):
-            self.epd.display(black, white)
-            self.epd.display(white, black)
-            self.epd.display(white, white)
+            self.epd.fill(isBlackInked=True)
+            self.epd.fill(isRedInked=True)
+            self.epd.fill()
         self.logger.info('E-Ink display calibration complete.')
+        if cycles > 0:
+            self.save_calibration_state({'refreshes': 0, 'ghosting': 0.0, 'fastRefreshes': 0})
+            if not (isRepainted and self.repaint()):
+                # the next update then only counts the pixels it inks as changed
+                self.save_last_frame(FrameBuffer.filled(self.epd.width, self.epd.height))
+
+    def load_calibration_state(self):
+        # Refreshes since the last calibration, the sum of the fraction of pixels each of them changed, and the fast
+        # refreshes since the last full one
+        try:
+            with open(self.calibrationFile, 'r') as file:
+                state = json.load(file)
+            return {'refreshes': int(state['refreshes']), 'ghosting': float(state['ghosting']),
+                    'fastRefreshes': int(state.get('fastRefreshes', 0))}
+        except (OSError, ValueError, KeyError, TypeError, AttributeError):
+            return {'refreshes': 0, 'ghosting': 0.0, 'fastRefreshes': 0}
+
+    def save_calibration_state(self, state):
+        with open(self.calibrationFile, 'w') as file:
+            json.dump(state, file)
+
+    def record_refresh(self, state, changeRatio, refreshMode):
+        # a refresh over an unknown previous frame (first run, lost last frame) adds no ghosting that can be measured
+        state['refreshes'] += 1
+        state['ghosting'] += changeRatio or 0.0
+        state['fastRefreshes'] = state['fastRefreshes'] + 1 if refreshMode == 'fast' else 0
+        self.save_calibration_state(state)
+
+    def is_calibration_due(self):
+        # Every pixel changed leaves a little ghosting behind, so the panel is calibrated once enough of it has
+        # changed since the last calibration (1.0 being the whole panel once), or after too many refreshes
+        state = self.load_calibration_state()
+        isDue = (state['refreshes'] >= self.calibrationMaxRefreshes or
+                 state['ghosting'] >= self.calibrationMaxGhosting)
+        self.logger.info('E-Ink display: {} refreshes and {:.2f} ghosting since calibration, calibration {}.'.format(
+            state['refreshes'], state['ghosting'], 'due' if isDue else 'not due'))
+        return isDue
 
     def sleep(self):
         # send E-Ink display to deep sleep
+        if not self.isInitialised:
+            return
         self.epd.EPD_Sleep()
+        self.isInitialised = False
         self.logger.info('E-Ink display entered deep sleep.')
 
+
+def count_changed_pixels(blackData, lastBlackData, redData, lastRedData):
+    # Counts the pixels where either plane differs, a set bit in the XOR of the planes is a changed pixel
+    changed = ((int.from_bytes(blackData, 'big') ^ int.from_bytes(lastBlackData, 'big')) |
+               (int.from_bytes(redData, 'big') ^ int.from_bytes(lastRedData, 'big')))
+    return bin(changed).count('1')
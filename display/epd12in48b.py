@@ -26,14 +26,43 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 #
+import os
+import queue
+import threading
 import time
-import display.epdconfig as epdconfig
+
+epdconfig = None
+
+def select_backend(name=None):
+    # 'hardware' drives the panel through RPi.GPIO and DEV_Config.so, 'simulator' records the traffic instead
+    # The EPD_BACKEND environment variable takes precedence over the name passed in
+    global epdconfig
+    name = os.environ.get('EPD_BACKEND') or name or 'hardware'
+    if name == 'simulator':
+        import display.epdsim as backend
+    else:
+        import display.epdconfig as backend
+    epdconfig = backend
+    return backend
 
 EPD_WIDTH       = 1304
 EPD_HEIGHT      = 984
+EPD_ROW_BYTES   = EPD_WIDTH // 8
+
+# (controller, first row, last row + 1, first byte in row, last byte in row + 1), in the order they are written
+EPD_QUADRANTS = (
+    ('S2', 0, 492, 0, 81),        # S2 part 648*492
+    ('M2', 0, 492, 81, 163),      # M2 part 656*492
+    ('M1', 492, 984, 0, 81),      # M1 part 648*492
+    ('S1', 492, 984, 81, 163),    # S1 part 656*492
+)
+
+INVERT_TABLE = bytes(0xFF - i for i in range(256))
 
 class EPD(object):
     def __init__(self):
+        if epdconfig is None:
+            select_backend()
         self.width = EPD_WIDTH
         self.height = EPD_HEIGHT
         
@@ -53,7 +82,16 @@ class EPD(object):
         self.EPD_M2_BUSY_PIN  = epdconfig.EPD_M2_BUSY_PIN
         self.EPD_S2_BUSY_PIN  = epdconfig.EPD_S2_BUSY_PIN
 
-    def Init(self):
+        # 'poll' checks each controller in turn, 'edge' waits on all BUSY pins together using GPIO edge detection
+        self.busyMode = 'poll'
+        self.busyTimeout = 60         # seconds each controller may stay busy in 'edge' mode
+        self.busySettleTime = 0.2     # seconds to wait after a controller is no longer busy
+        self.isPipelined = False      # pack the next quadrant in a worker thread while one is being sent
+        self.timings = {}             # pack, send and wait seconds of each controller in the last transfer
+        self.fillBuffers = {}         # constant buffers used by fill, by (value, size)
+        self.lutMode = None           # refresh mode of the LUTs the controllers have, 'full' or 'fast'
+
+    def Init(self, lutMode='full'):
         print("EPD init...")
         epdconfig.module_init()
         
@@ -147,162 +185,200 @@ class EPD(object):
         self.M2_SendCommand(0x82)
         self.M2_SendData(0x1c)
 
-        self.SetLut()
+        self.lutMode = None     # the reset cleared the LUTs
+        self.SetLut(lutMode)
         
+    def getbuffer(self, image):
+        # Packs an image into a 1-bit plane, 8 pixels per byte MSB first, where a set bit is white
+        imageconvert = image.convert('1')
+        if imageconvert.size != (self.width, self.height):
+            # unused bytes of the frame buffer are black, cropping outside the image fills with 0
+            imageconvert = imageconvert.crop((0, 0, self.width, self.height))
+        return imageconvert.tobytes()
+
+    def getquadrant(self, buf, quadrant):
+        # Returns the rows of a quadrant as memoryview slices of the packed frame buffer
+        name, rowStart, rowEnd, colStart, colEnd = quadrant
+        view = memoryview(buf)
+        return [view[y*EPD_ROW_BYTES + colStart:y*EPD_ROW_BYTES + colEnd] for y in range(rowStart, rowEnd)]
+
     def display(self, BlackImage, RedImage):
-        start = time.clock()
-        
-        Blackbuf = [0x00] * int(self.width * self.height / 8)
-        blackconvert = BlackImage.convert('1')       
-        bimwidth, bimheight = blackconvert.size 
-        Blackpixles = blackconvert.load()
-        temp=0;
-        for y in range(0, bimheight):
-            for x in range(0, bimwidth):
-                if Blackpixles[x, y] < 127:           # black
-                    Blackbuf[int((x + y*self.width)/8)] &= ~(0x80>>temp)
-                else:                           # white
-                    Blackbuf[int((x + y*self.width)/8)] |= (0x80>>temp)
-                temp=temp+1
-                if(temp==8):
-                    temp=0
-                    
-        Redbuf = [0x00] * int(self.width * self.height / 8)
-        redconvert = RedImage.convert('1')
-        rimwidth, rimheight = redconvert.size 
-        Redpixles = redconvert.load()
-        temp=0;
-        for y in range(0, rimheight):
-            for x in range(0, rimwidth):
-                if Redpixles[x, y] < 127:           # black
-                    Redbuf[int((x + y*self.width)/8)] &= ~(0x80>>temp)
-                else:                           # white
-                    Redbuf[int((x + y*self.width)/8)] |= (0x80>>temp)
-                temp=temp+1
-                if(temp==8):
-                    temp=0
-                    
-        #S2 part 648*492
-        self.S2_SendCommand(0x10)
-        for y in  range(0, 492):
-            for x in  range(0, 81):
-                self.S2_SendData(Blackbuf[y*163 + x])
-        self.S2_SendCommand(0x13)
-        for y in  range(0, 492):
-            for x in  range(0, 81):
-                self.S2_SendData(~Redbuf[y*163 + x])
-                
-        #M2 part 656*492
-        self.M2_SendCommand(0x10)
-        for y in  range(0, 492):
-            for x in  range(81, 163):
-                self.M2_SendData(Blackbuf[y*163 + x])
-        self.M2_SendCommand(0x13)
-        for y in  range(0, 492):
-            for x in  range(81, 163):
-                self.M2_SendData(~Redbuf[y*163 + x])
-
-        #M1 part 648*492    
-        self.M1_SendCommand(0x10)
-        for y in  range(492, 984):
-            for x in  range(0, 81):
-                self.M1_SendData(Blackbuf[y*163 + x])
-        self.M1_SendCommand(0x13)
-        for y in  range(492, 984):
-            for x in  range(0, 81):
-                self.M1_SendData(~Redbuf[y*163 + x])
-        
-        #S1 part 656*492
-        self.S1_SendCommand(0x10)
-        for y in  range(492, 984):
-            for x in  range(81, 163):
-                self.S1_SendData(Blackbuf[y*163 + x])
-        self.S1_SendCommand(0x13)
-        for y in  range(492, 984):
-            for x in  range(81, 163):
-                self.S1_SendData(~Redbuf[y*163 + x])
-                
-        end = time.clock()
+        self.display_buffers(self.getbuffer(BlackImage), self.getbuffer(RedImage))
+
+    def display_frame(self, frame, quadrants=EPD_QUADRANTS):
+        # Sends a display.framebuffer.FrameBuffer or FrameFile of the panel's size, no image conversion is needed
+        if (frame.width, frame.height) != (self.width, self.height):
+            raise ValueError('Frame is {}x{}, the panel is {}x{}'.format(frame.width, frame.height,
+                                                                       self.width, self.height))
+        # The frame's planes are already packed, so there is little for a worker thread to do ahead of the SPI writes,
+        # and it takes whole planes where iter_wire_planes streams an EncodedFrame one band at a time
+        if self.isPipelined:
+            self.send_transfers(self.pack_in_background(frame, quadrants), [quadrant[0] for quadrant in quadrants])
+        else:
+            transfers = ((quadrant[0], plane, data) for quadrant in quadrants
+                         for plane, data in enumerate(frame.iter_wire_planes(quadrant)))
+            self.send_transfers(transfers, [quadrant[0] for quadrant in quadrants], 'pack')
+
+    def display_buffers(self, Blackbuf, Redbuf, quadrants=EPD_QUADRANTS):
+        # Sends the packed planes of the given quadrants and refreshes only the controllers behind them
+        Redbuf = bytes(Redbuf).translate(INVERT_TABLE)  # red plane is sent inverted
+        transfers = ((quadrant[0], plane, b''.join(self.getquadrant(buf, quadrant)))
+                     for quadrant in quadrants for plane, buf in enumerate((Blackbuf, Redbuf)))
+        self.send_transfers(transfers, [quadrant[0] for quadrant in quadrants], 'pack')
+
+    def pack_in_background(self, frame, quadrants):
+        # Generates the transfers of a frame while a worker thread packs the following ones, the SPI writes release
+        # the GIL so packing overlaps with sending. At most two planes wait in the queue.
+        transfers = queue.Queue(maxsize=2)
+        isCancelled = threading.Event()
+
+        def put(item):
+            while not isCancelled.is_set():
+                try:
+                    transfers.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+
+        def pack():
+            try:
+                for quadrant in quadrants:
+                    for plane in (0, 1):  # black then red, the order the controller takes them
+                        start = time.perf_counter()
+                        data = frame.get_wire_plane(quadrant, plane)
+                        self.timings[quadrant[0]]['pack'] += time.perf_counter() - start
+                        put((quadrant[0], plane, data))
+            except Exception as e:
+                put(e)
+
+        worker = threading.Thread(target=pack, daemon=True)
+        worker.start()
+        try:
+            for i in range(2 * len(quadrants)):
+                item = transfers.get()
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            isCancelled.set()
+
+    def send_transfers(self, transfers, controllers, waitTiming='wait'):
+        # transfers yields (controller, 0 for black or 1 for inverted red, data) in the order they are sent, the data
+        # is a bytes-like object or an iterable of chunks, e.g. decoded while it is sent
+        # The time taken by transfers to yield the next item is added to the waitTiming timing: 'wait' when a worker
+        # thread packs the data, 'pack' when the generator packs it itself, in which case producing each chunk (e.g.
+        # decoding a band) counts as packing too rather than sending
+        start = time.perf_counter()
+        self.timings = {name: {'pack': 0.0, 'send': 0.0, 'wait': 0.0} for name in controllers}
+
+        waitStart = time.perf_counter()
+        for name, plane, data in transfers:
+            sendStart = time.perf_counter()
+            self.timings[name][waitTiming] += sendStart - waitStart
+            packStart = self.timings[name]['pack']
+            if waitTiming == 'pack' and not isinstance(data, (bytes, bytearray, memoryview)):
+                data = self.time_chunks(data, self.timings[name])
+            getattr(self, name + '_SendCommand')(0x13 if plane else 0x10)
+            getattr(self, name + '_SendBuffer')(data)
+            end = time.perf_counter()
+            self.timings[name]['send'] += end - sendStart - (self.timings[name]['pack'] - packStart)
+            waitStart = end
+
+        end = time.perf_counter()
         print("use time: %f"%(end - start))
-        self.TurnOnDisplay()
+        if len(controllers) == len(EPD_QUADRANTS):
+            self.TurnOnDisplay()
+        else:
+            self.TurnOnDisplay(controllers)
+
+    def time_chunks(self, chunks, timing):
+        # Yields the chunks, adding the time taken to produce each of them to timing['pack']
+        chunks = iter(chunks)
+        while True:
+            start = time.perf_counter()
+            chunk = next(chunks, None)
+            timing['pack'] += time.perf_counter() - start
+            if chunk is None:
+                return
+            yield chunk
 
     def clear(self):
         """Clear contents of image buffer"""
-        start = time.clock()
-        
-        self.S2_SendCommand(0x10)
-        for y in  range(0, 492):
-            for x in  range(0, 81):
-                self.S2_SendData(0xff)        
-        self.S2_SendCommand(0x13)
-        for y in  range(0, 492):
-            for x in  range(0, 81):
-                self.S2_SendData(0x00)
-                
-        self.M2_SendCommand(0x10)
-        for y in  range(0, 492):
-            for x in  range(81, 163):
-                self.M2_SendData(0xff)
-        self.M2_SendCommand(0x13)
-        for y in  range(0, 492):
-            for x in  range(81, 163):
-                self.M2_SendData(0x00)       
-                    
-        self.M1_SendCommand(0x10)
-        for y in  range(492, 984):
-            for x in  range(0, 81):
-                self.M1_SendData(0xff)
-        self.M1_SendCommand(0x13)
-        for y in  range(492, 984):
-            for x in  range(0, 81):
-                self.M1_SendData(0x00)
-                
-        self.S1_SendCommand(0x10)
-        for y in  range(492, 984):
-            for x in  range(81, 163):
-                self.S1_SendData(0xff)
-        self.S1_SendCommand(0x13)
-        for y in  range(492, 984):
-            for x in  range(81, 163):
-                self.S1_SendData(0x00)
-                
-        end = time.clock()
-        print (end)
-        print (start)
+        self.fill()
+
+    def fill(self, isBlackInked=False, isRedInked=False):
+        # Fills the whole panel with white, black or red and refreshes it. The constant planes are written to all
+        # four controllers at once, the bytes that only M2 and S1 have (their quadrants are a byte wider) follow.
+        start = time.perf_counter()
+
+        sizes = {name: (rowEnd - rowStart) * (colEnd - colStart)
+                 for name, rowStart, rowEnd, colStart, colEnd in EPD_QUADRANTS}
+        sharedSize = min(sizes.values())
+        # wire values: a set bit is white in the black plane, and the red plane is sent inverted
+        for command, value in ((0x10, 0x00 if isBlackInked else 0xFF), (0x13, 0xFF if isRedInked else 0x00)):
+            self.M1S1M2S2_SendCommand(command)
+            self.M1S1M2S2_SendBuffer(self.get_fill_buffer(value, sharedSize))
+            for name, size in sizes.items():
+                if size > sharedSize:
+                    getattr(self, name + '_SendBuffer')(self.get_fill_buffer(value, size - sharedSize))
+
+        end = time.perf_counter()
         print("use time: %f" %(end - start))
-        
+
         self.TurnOnDisplay()
-        
+
+    def get_fill_buffer(self, value, size):
+        # constant buffers are kept, calibrating sends the same ones several times
+        if (value, size) not in self.fillBuffers:
+            self.fillBuffers[(value, size)] = bytes([value]) * size
+        return self.fillBuffers[(value, size)]
+
     def Reset(self):
         epdconfig.digital_write(self.EPD_M1S1_RST_PIN, 1) 
         epdconfig.digital_write(self.EPD_M2S2_RST_PIN, 1) 
-        time.sleep(0.2) 
+        epdconfig.delay_ms(200) 
         epdconfig.digital_write(self.EPD_M1S1_RST_PIN, 0) 
         epdconfig.digital_write(self.EPD_M2S2_RST_PIN, 0) 
-        time.sleep(0.01) 
+        epdconfig.delay_ms(10) 
         epdconfig.digital_write(self.EPD_M1S1_RST_PIN, 1) 
         epdconfig.digital_write(self.EPD_M2S2_RST_PIN, 1) 
-        time.sleep(0.2) 
+        epdconfig.delay_ms(200) 
     
     def EPD_Sleep(self):
         self.M1S1M2S2_SendCommand(0X02)   	
-        time.sleep(0.3) 
+        epdconfig.delay_ms(300) 
 
         self.M1S1M2S2_SendCommand(0X07)   	
         self.M1S1M2S2_SendData(0xA5) 
-        time.sleep(0.3) 
+        epdconfig.delay_ms(300) 
         print("module_exit")
         epdconfig.module_exit()
 
-    def TurnOnDisplay(self):
+    def TurnOnDisplay(self, controllers=None):
+        # controllers limits the refresh to some of 'M1', 'S1', 'M2' and 'S2', all of them by default
         self.M1M2_SendCommand(0x04)  
-        time.sleep(0.3) 
-        self.M1S1M2S2_SendCommand(0x12) 
-        self.M1_ReadBusy()
-        self.S1_ReadBusy()
-        self.M2_ReadBusy()
-        self.S2_ReadBusy()   
+        epdconfig.delay_ms(300) 
+        if controllers is None:
+            controllers = ['M1', 'S1', 'M2', 'S2']
+            self.M1S1M2S2_SendCommand(0x12) 
+        else:
+            for name in controllers:
+                getattr(self, name + '_SendCommand')(0x12)
+        if self.busyMode == 'edge':
+            self.ReadBusyAll(controllers)
+        else:
+            for name in ['M1', 'S1', 'M2', 'S2']:
+                if name in controllers:
+                    getattr(self, name + '_ReadBusy')()
         
+    def write_buffer(self, buf):
+        # buf is a bytes-like object, or an iterable of them written back to back while CS stays low
+        if isinstance(buf, (bytes, bytearray, memoryview)):
+            epdconfig.spi_writebytes(buf)
+        else:
+            for chunk in buf:
+                epdconfig.spi_writebytes(chunk)
+
     """   M1S1M2S2 Write register address and data     """
     def M1S1M2S2_SendCommand(self, cmd):
         epdconfig.digital_write(self.EPD_M1S1_DC_PIN, 0)
@@ -332,6 +408,20 @@ class EPD(object):
         epdconfig.digital_write(self.EPD_M2_CS_PIN, 1)
         epdconfig.digital_write(self.EPD_S2_CS_PIN, 1)
 
+    def M1S1M2S2_SendBuffer(self, buf):
+        epdconfig.digital_write(self.EPD_M1S1_DC_PIN, 1)
+        epdconfig.digital_write(self.EPD_M2S2_DC_PIN, 1)
+
+        epdconfig.digital_write(self.EPD_M1_CS_PIN, 0)
+        epdconfig.digital_write(self.EPD_S1_CS_PIN, 0)
+        epdconfig.digital_write(self.EPD_M2_CS_PIN, 0)
+        epdconfig.digital_write(self.EPD_S2_CS_PIN, 0)
+        self.write_buffer(buf)
+        epdconfig.digital_write(self.EPD_M1_CS_PIN, 1)
+        epdconfig.digital_write(self.EPD_S1_CS_PIN, 1)
+        epdconfig.digital_write(self.EPD_M2_CS_PIN, 1)
+        epdconfig.digital_write(self.EPD_S2_CS_PIN, 1)
+
     """   M1M2 Write register address and data     """
     def M1M2_SendCommand(self, cmd):
         epdconfig.digital_write(self.EPD_M1S1_DC_PIN, 0)
@@ -362,6 +452,11 @@ class EPD(object):
         epdconfig.digital_write(self.EPD_S2_CS_PIN, 0)
         epdconfig.spi_writebyte(val)
         epdconfig.digital_write(self.EPD_S2_CS_PIN, 1)
+    def S2_SendBuffer(self, buf):
+        epdconfig.digital_write(self.EPD_M2S2_DC_PIN, 1)
+        epdconfig.digital_write(self.EPD_S2_CS_PIN, 0)
+        self.write_buffer(buf)
+        epdconfig.digital_write(self.EPD_S2_CS_PIN, 1)
         
     """   M2 Write register address and data     """
     def M2_SendCommand(self, cmd):
@@ -374,6 +469,11 @@ class EPD(object):
         epdconfig.digital_write(self.EPD_M2_CS_PIN, 0)
         epdconfig.spi_writebyte(val) 
         epdconfig.digital_write(self.EPD_M2_CS_PIN, 1)
+    def M2_SendBuffer(self, buf):
+        epdconfig.digital_write(self.EPD_M2S2_DC_PIN, 1)
+        epdconfig.digital_write(self.EPD_M2_CS_PIN, 0)
+        self.write_buffer(buf)
+        epdconfig.digital_write(self.EPD_M2_CS_PIN, 1)
 
     """   S1 Write register address and data     """
     def S1_SendCommand(self, cmd):
@@ -386,6 +486,11 @@ class EPD(object):
         epdconfig.digital_write(self.EPD_S1_CS_PIN, 0)
         epdconfig.spi_writebyte(val)
         epdconfig.digital_write(self.EPD_S1_CS_PIN, 1)
+    def S1_SendBuffer(self, buf):
+        epdconfig.digital_write(self.EPD_M1S1_DC_PIN, 1)
+        epdconfig.digital_write(self.EPD_S1_CS_PIN, 0)
+        self.write_buffer(buf)
+        epdconfig.digital_write(self.EPD_S1_CS_PIN, 1)
         
     """   M1 Write register address and data     """
     def M1_SendCommand(self, cmd):
@@ -398,6 +503,11 @@ class EPD(object):
         epdconfig.digital_write(self.EPD_M1_CS_PIN, 0)
         epdconfig.spi_writebyte(val)
         epdconfig.digital_write(self.EPD_M1_CS_PIN, 1)
+    def M1_SendBuffer(self, buf):
+        epdconfig.digital_write(self.EPD_M1S1_DC_PIN, 1)
+        epdconfig.digital_write(self.EPD_M1_CS_PIN, 0)
+        self.write_buffer(buf)
+        epdconfig.digital_write(self.EPD_M1_CS_PIN, 1)
 
     #Busy
     def M1_ReadBusy(self):
@@ -408,7 +518,7 @@ class EPD(object):
             self.M1_SendCommand(0x71) 
             busy = epdconfig.digital_read(self.EPD_M1_BUSY_PIN) 
             busy = not(busy & 0x01) 
-        time.sleep(0.2)
+        epdconfig.delay_ms(self.busySettleTime * 1000)
     def M2_ReadBusy(self):
         self.M2_SendCommand(0x71) 
         busy = epdconfig.digital_read(self.EPD_M2_BUSY_PIN) 
@@ -418,7 +528,7 @@ class EPD(object):
             self.M2_SendCommand(0x71) 
             busy = epdconfig.digital_read(self.EPD_M2_BUSY_PIN) 
             busy =not(busy & 0x01) 
-        time.sleep(0.2)
+        epdconfig.delay_ms(self.busySettleTime * 1000)
     def S1_ReadBusy(self):
         self.S1_SendCommand(0x71) 
         busy = epdconfig.digital_read(self.EPD_S1_BUSY_PIN) 
@@ -427,7 +537,7 @@ class EPD(object):
             self.S1_SendCommand(0x71) 
             busy = epdconfig.digital_read(self.EPD_S1_BUSY_PIN) 
             busy = not(busy & 0x01) 
-        time.sleep(0.2)        
+        epdconfig.delay_ms(self.busySettleTime * 1000)        
     def S2_ReadBusy(self):
         self.S2_SendCommand(0x71) 
         busy = epdconfig.digital_read(self.EPD_S2_BUSY_PIN) 
@@ -436,7 +546,16 @@ class EPD(object):
             self.S2_SendCommand(0x71) 
             busy = epdconfig.digital_read(self.EPD_S2_BUSY_PIN) 
             busy = not(busy & 0x01) 
-        time.sleep(0.2)            
+        epdconfig.delay_ms(self.busySettleTime * 1000)            
+
+    def ReadBusyAll(self, controllers=('M1', 'S1', 'M2', 'S2')):
+        # Returns once the last of the controllers is idle, or its timeout has expired
+        self.M1S1M2S2_SendCommand(0x71)
+        busyPins = [getattr(self, 'EPD_' + name + '_BUSY_PIN') for name in controllers]
+        timedOut = epdconfig.wait_until_idle({pin: self.busyTimeout for pin in busyPins})
+        if timedOut:
+            print("busy timeout on pins %s" % timedOut)
+        epdconfig.delay_ms(self.busySettleTime * 1000)
 
     lut_vcom1 = [
         0x00,	0x10,	0x10,	0x01,	0x08,	0x01,
@@ -499,27 +618,97 @@ class EPD(object):
         0x00,	0x00,	0x00,	0x00,	0x00,	0x00,
     ]
     
-    def SetLut(self):
+    # Fast refresh: the last three groups of the full waveforms, without the groups that flash the panel to shake
+    # the particles loose and with fewer repeats of the main drive, about a third of the full refresh time. Good for
+    # small changes, ghosting builds up so a full refresh has to follow now and then.
+    lut_vcom2 = [
+        0x00,	0x05,	0x01,	0x1E,	0x0F,	0x03,
+        0x00,	0x05,	0x01,	0x1E,	0x0F,	0x01,
+        0x00,	0x04,	0x05,	0x08,	0x08,	0x01,
+        0x00,	0x00,	0x00,	0x00,	0x00,	0x00,
+        0x00,	0x00,	0x00,	0x00,	0x00,	0x00,
+        0x00,	0x00,	0x00,	0x00,	0x00,	0x00,
+        0x00,	0x00,	0x00,	0x00,	0x00,	0x00,
+        0x00,	0x00,	0x00,	0x00,	0x00,	0x00,
+        0x00,	0x00,	0x00,	0x00,	0x00,	0x00,
+        0x00,	0x00,	0x00,	0x00,	0x00,	0x00,
+    ]
+    lut_ww2 = [
+        0x00,	0x05,	0x01,	0x1E,	0x0F,	0x03,
+        0x00,	0x05,	0x01,	0x1E,	0x0F,	0x01,
+        0x08,	0x04,	0x05,	0x08,	0x08,	0x01,
+        0x00,	0x00,	0x00,	0x00,	0x00,	0x00,
+        0x00,	0x00,	0x00,	0x00,	0x00,	0x00,
+        0x00,	0x00,	0x00,	0x00,	0x00,	0x00,
+        0x00,	0x00,	0x00,	0x00,	0x00,	0x00,
+        0x00,	0x00,	0x00,	0x00,	0x00,	0x00,
+        0x00,	0x00,	0x00,	0x00,	0x00,	0x00,
+        0x00,	0x00,	0x00,	0x00,	0x00,	0x00,
+    ]
+    lut_bw2 = [
+        0x8C,	0x05,	0x01,	0x1E,	0x0F,	0x03,
+        0x8C,	0x05,	0x01,	0x1E,	0x0F,	0x01,
+        0xF0,	0x04,	0x05,	0x08,	0x08,	0x01,
+        0x00,	0x00,	0x00,	0x00,	0x00,	0x00,
+        0x00,	0x00,	0x00,	0x00,	0x00,	0x00,
+        0x00,	0x00,	0x00,	0x00,	0x00,	0x00,
+        0x00,	0x00,	0x00,	0x00,	0x00,	0x00,
+        0x00,	0x00,	0x00,	0x00,	0x00,	0x00,
+        0x00,	0x00,	0x00,	0x00,	0x00,	0x00,
+        0x00,	0x00,	0x00,	0x00,	0x00,	0x00,
+    ]
+    lut_wb2 = [
+        0x00,	0x05,	0x01,	0x1E,	0x0F,	0x03,
+        0x00,	0x05,	0x01,	0x1E,	0x0F,	0x01,
+        0x08,	0x04,	0x05,	0x08,	0x08,	0x01,
+        0x00,	0x00,	0x00,	0x00,	0x00,	0x00,
+        0x00,	0x00,	0x00,	0x00,	0x00,	0x00,
+        0x00,	0x00,	0x00,	0x00,	0x00,	0x00,
+        0x00,	0x00,	0x00,	0x00,	0x00,	0x00,
+        0x00,	0x00,	0x00,	0x00,	0x00,	0x00,
+        0x00,	0x00,	0x00,	0x00,	0x00,	0x00,
+        0x00,	0x00,	0x00,	0x00,	0x00,	0x00,
+    ]
+    lut_bb2 = [
+        0x00,	0x05,	0x01,	0x1E,	0x0F,	0x03,
+        0x00,	0x05,	0x01,	0x1E,	0x0F,	0x01,
+        0x01,	0x04,	0x05,	0x08,	0x08,	0x01,
+        0x00,	0x00,	0x00,	0x00,	0x00,	0x00,
+        0x00,	0x00,	0x00,	0x00,	0x00,	0x00,
+        0x00,	0x00,	0x00,	0x00,	0x00,	0x00,
+        0x00,	0x00,	0x00,	0x00,	0x00,	0x00,
+        0x00,	0x00,	0x00,	0x00,	0x00,	0x00,
+        0x00,	0x00,	0x00,	0x00,	0x00,	0x00,
+        0x00,	0x00,	0x00,	0x00,	0x00,	0x00,
+    ]
+
+    # vcom, ww, bw, wb and bb waveforms of each refresh mode
+    lutSets = {
+        'full': (lut_vcom1, lut_ww1, lut_bw1, lut_wb1, lut_bb1),
+        'fast': (lut_vcom2, lut_ww2, lut_bw2, lut_wb2, lut_bb2),
+    }
+
+    def SetLut(self, mode='full'):
+        # Uploads the waveforms of a refresh mode, unless the controllers already have them
+        if mode == self.lutMode:
+            return
+        lut_vcom, lut_ww, lut_bw, lut_wb, lut_bb = self.lutSets[mode]
+
         self.M1S1M2S2_SendCommand(0x20) #vcom
-        for count in range(0, 60):
-            self.M1S1M2S2_SendData(self.lut_vcom1[count])
+        self.M1S1M2S2_SendBuffer(bytes(lut_vcom))
 
         self.M1S1M2S2_SendCommand(0x21) #red not use
-        for count in range(0, 60):
-            self.M1S1M2S2_SendData(self.lut_ww1[count])
+        self.M1S1M2S2_SendBuffer(bytes(lut_ww))
 
         self.M1S1M2S2_SendCommand(0x22) #bw r
-        for count in range(0, 60):
-            self.M1S1M2S2_SendData(self.lut_bw1[count])   # bw=r
+        self.M1S1M2S2_SendBuffer(bytes(lut_bw))   # bw=r
 
         self.M1S1M2S2_SendCommand(0x23) #wb w
-        for count in range(0, 60):
-            self.M1S1M2S2_SendData(self.lut_wb1[count])   # wb=w
+        self.M1S1M2S2_SendBuffer(bytes(lut_wb))   # wb=w
 
         self.M1S1M2S2_SendCommand(0x24) #bb b
-        for count in range(0, 60):
-            self.M1S1M2S2_SendData(self.lut_bb1[count])   # bb=b
-            
+        self.M1S1M2S2_SendBuffer(bytes(lut_bb))   # bb=b
+
         self.M1S1M2S2_SendCommand(0x25) #bb b
-        for count in range(0, 60):
-            self.M1S1M2S2_SendData(self.lut_ww1[count])   # bb=b
+        self.M1S1M2S2_SendBuffer(bytes(lut_ww))   # bb=b
+        self.lutMode = mode
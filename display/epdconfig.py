@@ -31,9 +31,15 @@ import time
 import os
 import logging
 import sys
+import threading
 
 from ctypes import *
 
+try:
+    import spidev
+except ImportError:
+    spidev = None
+
 EPD_SCK_PIN   =11
 EPD_MOSI_PIN  =10
 
@@ -72,6 +78,13 @@ for find_dir in find_dirs:
 if spi is None:
     RuntimeError('Cannot find DEV_Config.so')
 
+# Block transfers: 'dev' uses DEV_Config.so (DEV_SPI_Write_nByte when the library exports it),
+# 'spidev' uses the kernel SPI driver on /dev/spidev0.0, with the CS pins still driven as GPIOs
+SPI_BACKEND = os.environ.get('EPD_SPI_BACKEND', 'dev')
+SPI_SPEED_HZ = int(os.environ.get('EPD_SPI_SPEED_HZ', 4000000))
+spi_write_nbyte = getattr(spi, 'DEV_SPI_Write_nByte', None) if spi is not None else None
+spi_dev = None
+
 
 def digital_write(pin, value):
     GPIO.output(pin, value)
@@ -80,16 +93,80 @@ def digital_read(pin):
     return GPIO.input(pin)
 
 def spi_writebyte(value): 
-    spi.DEV_SPI_WriteByte(value)
+    if spi_dev is not None:
+        spi_dev.writebytes([value & 0xFF])
+    else:
+        spi.DEV_SPI_WriteByte(value)
+
+def spi_writebytes(data):
+    # Writes a whole buffer while the caller keeps CS asserted
+    if spi_dev is not None:
+        spi_dev.writebytes2(data)  # split into driver sized transfers by spidev
+    elif spi_write_nbyte is not None:
+        buf = (c_ubyte * len(data)).from_buffer_copy(data)
+        spi_write_nbyte(buf, len(data))
+    else:
+        for value in data:
+            spi.DEV_SPI_WriteByte(value)
  
+def wait_until_idle(timeouts):
+    # Waits for BUSY pins (low while busy) to go high, timeouts maps each pin to its limit in seconds
+    # Returns the pins that were still busy when their timeout expired
+    edge = threading.Event()
+    for pin in timeouts:
+        GPIO.add_event_detect(pin, GPIO.RISING, callback=lambda channel: edge.set())
+    try:
+        start = time.monotonic()
+        busy = [pin for pin in timeouts if not digital_read(pin)]
+        timedOut = []
+        while busy:
+            elapsed = time.monotonic() - start
+            timedOut += [pin for pin in busy if elapsed >= timeouts[pin]]
+            busy = [pin for pin in busy if pin not in timedOut]
+            if not busy:
+                break
+            # levels are read again after every wake up, so an edge missed between reads is not lost
+            edge.wait(min(timeouts[pin] for pin in busy) - elapsed)
+            edge.clear()
+            busy = [pin for pin in busy if not digital_read(pin)]
+        return timedOut
+    finally:
+        for pin in timeouts:
+            GPIO.remove_event_detect(pin)
+
 def delay_ms(delaytime):
     time.sleep(delaytime / 1000.0)
         
+def open_spidev():
+    # Returns the opened /dev/spidev0.0, or None to use DEV_Config.so instead
+    # spidev0.0 drives CE0, which is GPIO8 and also the CS pin of M1: unless the driver leaves CE0 alone, every
+    # block written to S1, M2 or S2 would be received by M1 as well
+    if SPI_BACKEND != 'spidev':
+        return None
+    if spidev is None:
+        logging.warning("EPD_SPI_BACKEND=spidev but the spidev module is not installed, using DEV_Config.so")
+        return None
+    dev = spidev.SpiDev()
+    try:
+        dev.open(0, 0)
+        dev.no_cs = True
+    except OSError as e:
+        dev.close()
+        logging.warning("spidev0.0 cannot be opened without driving CE0 (%s), using DEV_Config.so" % e)
+        return None
+    dev.max_speed_hz = SPI_SPEED_HZ
+    dev.mode = 0b00
+    return dev
+
 def module_init():
+    global spi_dev
     GPIO.setmode(GPIO.BCM)
     GPIO.setwarnings(False)
-    GPIO.setup(EPD_SCK_PIN, GPIO.OUT)    
-    GPIO.setup(EPD_MOSI_PIN, GPIO.OUT)
+    spi_dev = open_spidev()
+    if spi_dev is None:
+        # with spidev, SCK and MOSI must stay in their SPI alternate function
+        GPIO.setup(EPD_SCK_PIN, GPIO.OUT)    
+        GPIO.setup(EPD_MOSI_PIN, GPIO.OUT)
     
     logging.debug("python call bcm2835 Lib")
     
@@ -117,9 +194,16 @@ def module_init():
     digital_write(EPD_M2S2_DC_PIN, 1)
     digital_write(EPD_M1S1_DC_PIN, 1)
 
-    spi.DEV_ModuleInit()
+    if spi_dev is not None:
+        logging.debug("python call spidev")
+    else:
+        spi.DEV_ModuleInit()
 
 def module_exit():
+    global spi_dev
+    if spi_dev is not None:
+        spi_dev.close()
+        spi_dev = None
     digital_write(EPD_M2S2_RST_PIN, 0)
     digital_write(EPD_M1S1_RST_PIN, 0)
     digital_write(EPD_M2S2_DC_PIN, 0)
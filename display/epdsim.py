@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Drop-in replacement for epdconfig that simulates the 12.48" panel instead of driving it. Every GPIO write, SPI
+byte/block and BUSY poll is recorded, and a virtual clock models how long the same traffic takes on the Raspberry Pi,
+so the driver can be checked and benchmarked on a machine without the display attached.
+
+Select it with EPD_BACKEND=simulator, or "displayBackend": "simulator" in config.json. The timing model is configured
+with the EPD_SIM_* environment variables below. Run "python3 -m display.epdsim" for a timing report.
+"""
+
+import os
+import logging
+
+EPD_SCK_PIN   =11
+EPD_MOSI_PIN  =10
+
+EPD_M1_CS_PIN  =8
+EPD_S1_CS_PIN  =7
+EPD_M2_CS_PIN  =17
+EPD_S2_CS_PIN  =18
+
+EPD_M1S1_DC_PIN  =13
+EPD_M2S2_DC_PIN  =22
+
+EPD_M1S1_RST_PIN =6
+EPD_M2S2_RST_PIN =23
+
+EPD_M1_BUSY_PIN  =5
+EPD_S1_BUSY_PIN  =19
+EPD_M2_BUSY_PIN  =27
+EPD_S2_BUSY_PIN  =24
+
+# controller: (CS pin, DC pin, BUSY pin)
+CONTROLLERS = {
+    'M1': (EPD_M1_CS_PIN, EPD_M1S1_DC_PIN, EPD_M1_BUSY_PIN),
+    'S1': (EPD_S1_CS_PIN, EPD_M1S1_DC_PIN, EPD_S1_BUSY_PIN),
+    'M2': (EPD_M2_CS_PIN, EPD_M2S2_DC_PIN, EPD_M2_BUSY_PIN),
+    'S2': (EPD_S2_CS_PIN, EPD_M2S2_DC_PIN, EPD_S2_BUSY_PIN),
+}
+
+# Timing model, in seconds unless stated otherwise
+SPI_SPEED_HZ = float(os.environ.get('EPD_SIM_SPI_HZ', 4000000))
+SPI_CALL_TIME = float(os.environ.get('EPD_SIM_SPI_CALL_TIME', 0.00002))  # overhead of each byte or block call
+GPIO_WRITE_TIME = float(os.environ.get('EPD_SIM_GPIO_WRITE_TIME', 0.000005))
+GPIO_READ_TIME = float(os.environ.get('EPD_SIM_GPIO_READ_TIME', 0.000005))
+REFRESH_TIME = float(os.environ.get('EPD_SIM_REFRESH_TIME', 16.0))  # BUSY low after a refresh (0x12) command
+RECORD_TRACE = os.environ.get('EPD_SIM_TRACE', '1') != '0'  # set to 0 to keep only counters and frame buffers
+
+
+class PanelSimulator:
+
+    def __init__(self):
+        self.panel = None  # packed black and red planes shown by the panel, kept across reset() like the panel is
+        self.reset()
+
+    def reset(self):
+        self.clock = 0.0
+        self.trace = []  # (clock, kind, details) for every recorded operation
+        self.pins = {}
+        self.busyUntil = {name: 0.0 for name in CONTROLLERS}
+        self.command = {name: None for name in CONTROLLERS}
+        self.data = {name: {} for name in CONTROLLERS}  # data bytes received after each command
+        self.refreshes = {name: 0 for name in CONTROLLERS}
+        self.gpioWrites = 0
+        self.spiBytes = 0
+        self.spiCalls = 0
+        self.busyPolls = 0
+
+    def record(self, kind, details):
+        if RECORD_TRACE:
+            self.trace.append((self.clock, kind, details))
+
+    def write_pin(self, pin, value):
+        self.clock += GPIO_WRITE_TIME
+        self.gpioWrites += 1
+        self.pins[pin] = value
+        self.record('gpio', (pin, value))
+
+    def read_pin(self, pin):
+        self.clock += GPIO_READ_TIME
+        for name, (csPin, dcPin, busyPin) in CONTROLLERS.items():
+            if busyPin == pin:
+                self.busyPolls += 1
+                value = 1 if self.clock >= self.busyUntil[name] else 0  # BUSY is low while refreshing
+                self.record('busy', (pin, value))
+                return value
+        return self.pins.get(pin, 0)
+
+    def write_spi(self, data):
+        self.clock += SPI_CALL_TIME + len(data) * 8 / SPI_SPEED_HZ
+        self.spiCalls += 1
+        self.spiBytes += len(data)
+        self.record('spi', data)
+        for name, (csPin, dcPin, busyPin) in CONTROLLERS.items():
+            if self.pins.get(csPin, 1) != 0:
+                continue
+            if self.pins.get(dcPin, 1) == 0:
+                # every byte written while DC is low is a command
+                for cmd in data:
+                    self.receive_command(name, cmd)
+            elif self.command[name] is not None:
+                self.data[name][self.command[name]].extend(data)
+
+    def receive_command(self, name, cmd):
+        self.command[name] = cmd
+        self.data[name][cmd] = bytearray()
+        if cmd == 0x12:  # display refresh
+            self.refreshes[name] += 1
+            self.show_planes(name)
+            self.busyUntil[name] = self.clock + REFRESH_TIME
+
+    def wait_until_idle(self, timeouts):
+        timedOut = []
+        start = self.clock
+        end = start
+        for pin, timeout in timeouts.items():
+            name = [name for name, pins in CONTROLLERS.items() if pins[2] == pin][0]
+            if self.busyUntil[name] - start > timeout:
+                timedOut.append(pin)
+                end = max(end, start + timeout)
+            else:
+                end = max(end, self.busyUntil[name])
+        self.clock = end
+        self.record('wait', (dict(timeouts), timedOut))
+        return timedOut
+
+    def show_planes(self, name):
+        # Copies the planes the controller received into the panel, a plane it did not receive in full since the
+        # last reset() is left as the panel shows it
+        from display.epd12in48b import EPD_QUADRANTS, EPD_ROW_BYTES, EPD_HEIGHT, INVERT_TABLE
+        if self.panel is None:
+            self.panel = tuple(bytearray(b'\xff' * EPD_ROW_BYTES * EPD_HEIGHT) for plane in range(2))
+        name, rowStart, rowEnd, colStart, colEnd = [quadrant for quadrant in EPD_QUADRANTS if quadrant[0] == name][0]
+        rowBytes = colEnd - colStart
+        for plane, cmd in enumerate((0x10, 0x13)):
+            data = self.data[name].get(cmd)
+            if data is None or len(data) != (rowEnd - rowStart) * rowBytes:
+                continue
+            if cmd == 0x13:
+                data = bytes(data).translate(INVERT_TABLE)  # red plane is sent inverted
+            for y in range(rowStart, rowEnd):
+                offset = (y - rowStart) * rowBytes
+                self.panel[plane][y*EPD_ROW_BYTES + colStart:y*EPD_ROW_BYTES + colEnd] = data[offset:offset + rowBytes]
+
+    def get_planes(self):
+        # Returns the packed black and red planes (set bit = white) the panel shows, white before any refresh
+        from display.epd12in48b import EPD_ROW_BYTES, EPD_HEIGHT
+        if self.panel is None:
+            return b'\xff' * EPD_ROW_BYTES * EPD_HEIGHT, b'\xff' * EPD_ROW_BYTES * EPD_HEIGHT
+        return bytes(self.panel[0]), bytes(self.panel[1])
+
+    def report(self):
+        return {'simulatedTime': self.clock, 'gpioWrites': self.gpioWrites, 'spiBytes': self.spiBytes,
+                'spiCalls': self.spiCalls, 'busyPolls': self.busyPolls, 'refreshes': dict(self.refreshes)}
+
+
+simulator = PanelSimulator()
+
+
+def digital_write(pin, value):
+    simulator.write_pin(pin, value)
+
+def digital_read(pin):
+    return simulator.read_pin(pin)
+
+def spi_writebyte(value):
+    simulator.write_spi(bytes([value & 0xFF]))
+
+def spi_writebytes(data):
+    simulator.write_spi(bytes(data))
+
+def wait_until_idle(timeouts):
+    return simulator.wait_until_idle(timeouts)
+
+def delay_ms(delaytime):
+    simulator.clock += delaytime / 1000.0
+    simulator.record('delay', delaytime)
+
+def module_init():
+    logging.debug("simulated panel init")
+    digital_write(EPD_M1_CS_PIN, 1)
+    digital_write(EPD_S1_CS_PIN, 1)
+    digital_write(EPD_M2_CS_PIN, 1)
+    digital_write(EPD_S2_CS_PIN, 1)
+
+    digital_write(EPD_M2S2_RST_PIN, 0)
+    digital_write(EPD_M1S1_RST_PIN, 0)
+    digital_write(EPD_M2S2_DC_PIN, 1)
+    digital_write(EPD_M1S1_DC_PIN, 1)
+
+def module_exit():
+    digital_write(EPD_M2S2_RST_PIN, 0)
+    digital_write(EPD_M1S1_RST_PIN, 0)
+    digital_write(EPD_M2S2_DC_PIN, 0)
+    digital_write(EPD_M1S1_DC_PIN, 0)
+    digital_write(EPD_S1_CS_PIN, 1)
+    digital_write(EPD_S2_CS_PIN, 1)
+    digital_write(EPD_M1_CS_PIN, 1)
+    digital_write(EPD_M2_CS_PIN, 1)
+
+
+def main():
+    # Reports the simulated wall time of the main display operations and checks the frame buffers received
+    from PIL import Image, ImageDraw
+    import tempfile
+    import display.epd12in48b as eink
+    from display.display import DisplayHelper
+    from display.framebuffer import FrameBuffer
+
+    # use the module instance the driver imports, which is not this one when run with "python3 -m"
+    simulator = eink.select_backend('simulator').simulator
+    # calibrating writes the last frame and calibration state, which must not replace those of the real panel
+    stateDir = tempfile.TemporaryDirectory()
+    displayService = DisplayHelper(eink.EPD_WIDTH, eink.EPD_HEIGHT, stateDir=stateDir.name)
+    displayService.init_display()
+    print('Init: {:.3f}s simulated'.format(simulator.clock))
+
+    black = Image.new('1', (eink.EPD_WIDTH, eink.EPD_HEIGHT), 'white')
+    red = Image.new('1', (eink.EPD_WIDTH, eink.EPD_HEIGHT), 'white')
+    ImageDraw.Draw(black).rectangle((100, 100, 700, 600), fill='black')
+    ImageDraw.Draw(red).ellipse((600, 400, 1200, 900), fill='black')
+
+    for label, operation in (('EPD.display', lambda: displayService.epd.display(black, red)),
+                             ('EPD.clear', displayService.epd.clear),
+                             ('DisplayHelper.calibrate', lambda: displayService.calibrate(cycles=1))):
+        simulator.reset()
+        operation()
+        stats = simulator.report()
+        print('{}: {:.3f}s simulated, {} SPI bytes in {} calls, {} GPIO writes, {} BUSY polls'.format(
+            label, stats['simulatedTime'], stats['spiBytes'], stats['spiCalls'], stats['gpioWrites'],
+            stats['busyPolls']))
+
+    simulator.reset()
+    displayService.epd.display(black, red)
+    blackbuf, redbuf = simulator.get_planes()
+    isMatch = blackbuf == black.tobytes() and redbuf == red.tobytes()
+    print('Frame buffers reconstructed from SPI traffic match: {}'.format(isMatch))
+
+    # a partial update only sends the quadrant that changed, the others must keep what they show
+    name, rowStart, rowEnd, colStart, colEnd = quadrant = eink.EPD_QUADRANTS[-1]
+    ImageDraw.Draw(black).rectangle((colStart * 8 + 50, rowStart + 50, colEnd * 8 - 50, rowEnd - 50), fill='black')
+    simulator.reset()
+    displayService.epd.display_frame(FrameBuffer.from_images(black, red), (quadrant,))
+    blackbuf, redbuf = simulator.get_planes()
+    isMatch = blackbuf == black.tobytes() and redbuf == red.tobytes()
+    print('Frame buffers reconstructed after updating {} only match: {}'.format(name, isMatch))
+    stateDir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Thin display client for server.server: fetches this display's frame file and shows it. The ETag of the frame last
+fetched is kept next to the frame file and sent as If-None-Match, so when the server replies 304 the panel is not
+woken up at all. Like display.showframe, it imports neither Pillow, Selenium nor the Google client.
+
+    python3 -m display.fetchframe http://renderhost:8080/frame/kitchen
+    python3 -m display.fetchframe http://127.0.0.1:8080/frame/default --no-display     # stub client, fetch only
+    python3 -m display.fetchframe http://renderhost:8080/frame/kitchen.fbz     # encoded, decoded while it is sent
+"""
+
+import argparse
+import logging
+import os
+import pathlib
+import sys
+import urllib.error
+import urllib.request
+from display.framebuffer import FrameFile, write_file
+from display.framecodec import CODEC_MAGIC, EncodedFrame
+
+
+def fetch_frame(url, frameFile, timeout=60):
+    # Downloads the frame to frameFile unless the server still has the one last shown
+    # Returns the ETag of the new frame, to be saved with save_etag once it is shown, or None when it is unchanged
+    etagFile = frameFile + '.etag'
+    request = urllib.request.Request(url)
+    if os.path.exists(frameFile) and os.path.exists(etagFile):
+        with open(etagFile, 'r') as file:
+            request.add_header('If-None-Match', file.read().strip())
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            frame = response.read()
+            etag = response.headers.get('ETag', '')
+    except urllib.error.HTTPError as e:
+        if e.code == 304:
+            return None
+        raise
+
+    if os.path.exists(etagFile):
+        os.remove(etagFile)  # until the new frame is shown
+    write_file(frameFile, (frame,))
+    open_frame(frameFile)  # raises ValueError if the frame is not valid
+    return etag
+
+
+def open_frame(frameFile):
+    # Opens a frame file, or an encoded frame from display.framecodec
+    with open(frameFile, 'rb') as file:
+        if file.read(len(CODEC_MAGIC)) == CODEC_MAGIC:
+            return EncodedFrame.load(frameFile)
+    return FrameFile(frameFile)
+
+
+def save_etag(frameFile, etag):
+    if etag:
+        write_file(frameFile + '.etag', (etag.encode('utf-8'),))
+
+
+def main():
+    currPath = str(pathlib.Path(__file__).parent.absolute())
+    parser = argparse.ArgumentParser(description='Fetch a frame from the render server and show it.')
+    parser.add_argument('url', help='frame URL, e.g. http://renderhost:8080/frame/default')
+    parser.add_argument('--frameFile', default=currPath + '/fetched.fb', help='where the fetched frame is kept')
+    parser.add_argument('--no-display', dest='isDisplayed', action='store_false',
+                        help='only fetch the frame, e.g. to test the server')
+    parser.add_argument('--backend', default=None, help="'hardware' or 'simulator'")
+    args = parser.parse_args()
+
+    logging.basicConfig(stream=sys.stdout, format='%(asctime)s %(levelname)s - %(message)s')
+    logger = logging.getLogger('maginkcal')
+    logger.setLevel(logging.INFO)
+
+    try:
+        etag = fetch_frame(args.url, args.frameFile)
+    except (OSError, ValueError) as e:
+        logger.error('Fetching {} failed: {}'.format(args.url, e))
+        return 1
+    if etag is None:
+        logger.info('Frame unchanged on the server, display refresh skipped.')
+        return 0
+    logger.info('New frame fetched from {}.'.format(args.url))
+
+    if args.isDisplayed:
+        import display.epd12in48b as eink
+        from display.display import DisplayHelper
+        displayService = DisplayHelper(eink.EPD_WIDTH, eink.EPD_HEIGHT, backend=args.backend)
+        try:
+            displayService.update(open_frame(args.frameFile))
+        finally:
+            displayService.sleep()
+    save_etag(args.frameFile, etag)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
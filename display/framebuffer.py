@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+The frame handed from the renderer to the display: a black and a red bit-plane, packed 8 pixels per byte with the
+most significant bit first and a set bit for white, as the panel controllers expect them (the red plane is inverted on
+the way out by the driver). Rows are padded to whole bytes.
+
+Only packing an image needs Pillow, and it is imported there, so the display side can handle frames without it.
+
+Frames are saved in a wire-ready file: a header, a table of the panel's quadrants, then for each quadrant in turn its
+black data and its inverted red data, exactly the bytes each controller receives. FrameFile maps such a file into
+memory and hands out slices of it, so the file can be streamed to the panel without unpacking or copying it.
+"""
+
+import mmap
+import os
+import struct
+import zlib
+from display.epd12in48b import EPD_QUADRANTS, INVERT_TABLE
+
+FRAME_MAGIC = b'MKFB'
+FRAME_VERSION = 1
+FRAME_HEADER = struct.Struct('<4sHHHHI')  # magic, version, width, height, quadrant count, CRC-32 of the data
+FRAME_QUADRANT = struct.Struct('<2sHHHH')  # controller, first row, last row + 1, first byte in row, last byte + 1
+
+# rotate(angle, expand=True) for the angles that are a plain transpose of the pixels
+TRANSPOSE_METHODS = {90: 'ROTATE_90', 180: 'ROTATE_180', 270: 'ROTATE_270'}
+
+
+def pack_plane(image, angle=0):
+    # Rotates an image counter-clockwise by angle and packs it into a 1-bit plane, returns (width, height, bytes)
+    # Rotating before the conversion keeps the dithering of the rotated image, as when the panel driver converted it
+    from PIL import Image
+    angle %= 360
+    if angle in TRANSPOSE_METHODS:
+        methods = getattr(Image, 'Transpose', Image)  # Pillow before 9.1 has the methods on Image itself
+        image = image.transpose(getattr(methods, TRANSPOSE_METHODS[angle]))
+    elif angle:
+        image = image.rotate(angle, expand=True)
+    image = image.convert('1')
+    return image.size[0], image.size[1], image.tobytes()
+
+
+class FrameBuffer:
+
+    def __init__(self, width, height, black, red):
+        self.width = width
+        self.height = height
+        self.rowBytes = (width + 7) // 8
+        if len(black) != self.rowBytes * height or len(red) != self.rowBytes * height:
+            raise ValueError('Planes do not match a {}x{} frame'.format(width, height))
+        self.black = black
+        self.red = red
+
+    @classmethod
+    def from_images(cls, blackimg, redimg, angle=0):
+        # Packs a black and a red image (dark pixels are inked) into a frame, rotated by angle
+        width, height, black = pack_plane(blackimg, angle)
+        redWidth, redHeight, red = pack_plane(redimg, angle)
+        if (redWidth, redHeight) != (width, height):
+            raise ValueError('Black and red images differ in size')
+        return cls(width, height, black, red)
+
+    @classmethod
+    def filled(cls, width, height, isBlackInked=False, isRedInked=False):
+        # A frame where each plane is entirely inked or entirely white, e.g. for clearing or calibrating the panel
+        planeSize = (width + 7) // 8 * height
+        black = (b'\x00' if isBlackInked else b'\xff') * planeSize
+        red = (b'\x00' if isRedInked else b'\xff') * planeSize
+        return cls(width, height, black, red)
+
+    def __eq__(self, other):
+        return (isinstance(other, FrameBuffer) and (self.width, self.height) == (other.width, other.height) and
+                self.black == other.black and self.red == other.red)
+
+    def fit(self, width, height):
+        # Returns the frame cropped or padded at the right and bottom to width x height, padding is inked (0) like
+        # cropping an image beyond its edges with Pillow
+        if (width, height) == (self.width, self.height):
+            return self
+        rowBytes = (width + 7) // 8
+        copyBytes = min(rowBytes, self.rowBytes)
+        lastMask = 0xFF
+        if width < self.width and width % 8:
+            lastMask = (0xFF << (8 - width % 8)) & 0xFF  # clear the bits beyond the new width
+        planes = []
+        for plane in (self.black, self.red):
+            fitted = bytearray(rowBytes * height)
+            for y in range(min(height, self.height)):
+                fitted[y*rowBytes:y*rowBytes + copyBytes] = plane[y*self.rowBytes:y*self.rowBytes + copyBytes]
+                if lastMask != 0xFF:
+                    fitted[y*rowBytes + rowBytes - 1] &= lastMask
+            planes.append(bytes(fitted))
+        return FrameBuffer(width, height, planes[0], planes[1])
+
+    def get_wire_plane(self, quadrant, plane):
+        # Returns the black (0) data or the inverted red (1) data of a quadrant, as the controller takes it
+        name, rowStart, rowEnd, colStart, colEnd = quadrant
+        view = memoryview(self.red if plane else self.black)
+        rows = range(rowStart * self.rowBytes, rowEnd * self.rowBytes, self.rowBytes)
+        data = b''.join(view[offset + colStart:offset + colEnd] for offset in rows)
+        return data.translate(INVERT_TABLE) if plane else data
+
+    def get_wire_planes(self, quadrant):
+        # Returns the black data and the inverted red data of a quadrant, in the order the controller takes them
+        return self.get_wire_plane(quadrant, 0), self.get_wire_plane(quadrant, 1)
+
+    def iter_wire_planes(self, quadrant):
+        # Same data as get_wire_planes, as sequences of chunks to be sent back to back
+        blackData, redData = self.get_wire_planes(quadrant)
+        return (blackData,), (redData,)
+
+    def to_bytes(self, quadrants=EPD_QUADRANTS):
+        # Returns the frame in the wire-ready frame file format, see FrameFile, fitted to the size the quadrants cover
+        frame = self.fit(max(quadrant[4] for quadrant in quadrants) * 8, max(quadrant[2] for quadrant in quadrants))
+        data = b''.join(plane for quadrant in quadrants for plane in frame.get_wire_planes(quadrant))
+        return get_frame_header(frame.width, frame.height, quadrants, zlib.crc32(data)) + data
+
+    def save(self, path, quadrants=EPD_QUADRANTS):
+        write_file(path, (self.to_bytes(quadrants),))
+
+    def to_images(self):
+        # Unpacks the planes into 1-bit Pillow images, for previews and comparisons
+        from PIL import Image
+        size = (self.width, self.height)
+        return Image.frombytes('1', size, self.black), Image.frombytes('1', size, self.red)
+
+
+def get_frame_header(width, height, quadrants, crc):
+    # Header and quadrant table of a frame file, crc is the CRC-32 of the data that follows them
+    header = FRAME_HEADER.pack(FRAME_MAGIC, FRAME_VERSION, width, height, len(quadrants), crc)
+    return header + b''.join(FRAME_QUADRANT.pack(quadrant[0].encode('ascii'), *quadrant[1:])
+                             for quadrant in quadrants)
+
+
+def write_file(path, chunks):
+    # write to a temporary file first, so an interrupted write never leaves a partial frame behind
+    with open(path + '.tmp', 'wb') as frameFile:
+        for chunk in chunks:
+            frameFile.write(chunk)
+    os.replace(path + '.tmp', path)
+
+
+class FrameFile:
+
+    def __init__(self, path, quadrants=EPD_QUADRANTS, isVerified=True):
+        # Maps a frame file written by FrameBuffer.save, raises ValueError if it is not a valid frame for quadrants
+        # isVerified checks the CRC of the data, which reads the whole file once
+        with open(path, 'rb') as frameFile:
+            self.map = mmap.mmap(frameFile.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.map)
+        try:
+            self.planes = self.parse(quadrants, isVerified)
+        except (ValueError, struct.error):
+            self.close()
+            raise
+
+    def parse(self, quadrants, isVerified):
+        magic, version, self.width, self.height, count, crc = FRAME_HEADER.unpack_from(self.view)
+        if magic != FRAME_MAGIC or version != FRAME_VERSION:
+            raise ValueError('Not a frame file')
+        offset = FRAME_HEADER.size
+        table = []
+        for i in range(count):
+            name, rowStart, rowEnd, colStart, colEnd = FRAME_QUADRANT.unpack_from(self.view, offset)
+            table.append((name.decode('ascii'), rowStart, rowEnd, colStart, colEnd))
+            offset += FRAME_QUADRANT.size
+        if tuple(table) != tuple(quadrants):
+            raise ValueError('Frame file does not match the panel layout')
+        dataStart = offset
+        planes = {}
+        for name, rowStart, rowEnd, colStart, colEnd in table:
+            size = (rowEnd - rowStart) * (colEnd - colStart)
+            planes[name] = (self.view[offset:offset + size], self.view[offset + size:offset + 2 * size])
+            offset += 2 * size
+        if offset != len(self.view):
+            raise ValueError('Frame file is truncated')
+        if isVerified and zlib.crc32(self.view[dataStart:]) != crc:
+            raise ValueError('Frame file is corrupted')
+        return planes
+
+    def get_wire_plane(self, quadrant, plane):
+        return self.planes[quadrant[0]][plane]
+
+    def get_wire_planes(self, quadrant):
+        # Same as FrameBuffer.get_wire_planes, as slices of the mapped file
+        return self.planes[quadrant[0]]
+
+    def iter_wire_planes(self, quadrant):
+        blackData, redData = self.planes[quadrant[0]]
+        return (blackData,), (redData,)
+
+    def fit(self, width, height):
+        if (width, height) != (self.width, self.height):
+            raise ValueError('Frame is {}x{}, expected {}x{}'.format(self.width, self.height, width, height))
+        return self
+
+    def save(self, path):
+        write_file(path, (self.view,))
+
+    def close(self):
+        self.planes = {}
+        self.view.release()
+        try:
+            self.map.close()
+        except BufferError:
+            pass  # slices handed out are still in use, the mapping goes once they are released
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Compact encoding of a frame, for keeping a history of frames or sending them to clients with little memory. The wire
+data of each quadrant plane (see FrameBuffer.get_wire_planes) is cut into bands of rows and each band is deflated on
+its own. Calendar planes are mostly long runs of white (and the red plane is almost empty), which deflate reduces to a
+few bytes, and zlib decodes in C where a hand written run-length decoder would loop in Python.
+
+Because the bands are independent, EncodedFrame decodes them one at a time: DisplayHelper compares them band by band
+with the last frame, then the driver decodes the bands of the quadrants that changed again while sending them, and
+saving the frame as the last frame decodes it twice more (for the CRC, then the data). Decoding costs little next to
+the transfer, and the panel is updated without ever holding more than one band of decoded data instead of the full
+planes.
+
+    python3 -m display.framecodec render/calendar.fb    # compression ratio and decode throughput of a frame file
+"""
+
+import itertools
+import struct
+import zlib
+from display.epd12in48b import EPD_QUADRANTS
+from display.framebuffer import FRAME_QUADRANT, get_frame_header, write_file
+
+CODEC_MAGIC = b'MKFZ'
+CODEC_VERSION = 1
+CODEC_HEADER = struct.Struct('<4sHHHHH')  # magic, version, width, height, quadrant count, rows per band
+CODEC_BAND = struct.Struct('<I')  # length of the deflated band that follows
+BAND_ROWS = 41  # 12 bands per quadrant plane of 492 rows
+
+
+def encode_frame(frame, quadrants=EPD_QUADRANTS, bandRows=BAND_ROWS, level=9):
+    # Encodes a FrameBuffer or FrameFile, fitted to the size the quadrants cover
+    frame = frame.fit(max(quadrant[4] for quadrant in quadrants) * 8, max(quadrant[2] for quadrant in quadrants))
+    chunks = [CODEC_HEADER.pack(CODEC_MAGIC, CODEC_VERSION, frame.width, frame.height, len(quadrants), bandRows)]
+    chunks += [FRAME_QUADRANT.pack(quadrant[0].encode('ascii'), *quadrant[1:]) for quadrant in quadrants]
+    for quadrant in quadrants:
+        bandSize = bandRows * (quadrant[4] - quadrant[3])
+        for data in frame.get_wire_planes(quadrant):
+            for offset in range(0, len(data), bandSize):
+                band = zlib.compress(data[offset:offset + bandSize], level)
+                chunks.append(CODEC_BAND.pack(len(band)))
+                chunks.append(band)
+    return b''.join(chunks)
+
+
+class EncodedFrame:
+
+    def __init__(self, data, quadrants=EPD_QUADRANTS):
+        # data is an encoded frame from encode_frame, raises ValueError if it is not valid for quadrants
+        self.data = memoryview(data)
+        try:
+            magic, version, self.width, self.height, count, self.bandRows = CODEC_HEADER.unpack_from(self.data)
+            if magic != CODEC_MAGIC or version != CODEC_VERSION:
+                raise ValueError('Not an encoded frame')
+            offset = CODEC_HEADER.size
+            table = []
+            for i in range(count):
+                name, rowStart, rowEnd, colStart, colEnd = FRAME_QUADRANT.unpack_from(self.data, offset)
+                table.append((name.decode('ascii'), rowStart, rowEnd, colStart, colEnd))
+                offset += FRAME_QUADRANT.size
+            if tuple(table) != tuple(quadrants):
+                raise ValueError('Encoded frame does not match the panel layout')
+
+            # offsets of the deflated bands of each quadrant's black and red data
+            self.bands = {}
+            for name, rowStart, rowEnd, colStart, colEnd in table:
+                bandCount = -(-(rowEnd - rowStart) // self.bandRows)
+                planes = []
+                for plane in range(2):
+                    bands = []
+                    for band in range(bandCount):
+                        length, = CODEC_BAND.unpack_from(self.data, offset)
+                        offset += CODEC_BAND.size
+                        bands.append((offset, length))
+                        offset += length
+                    planes.append(bands)
+                self.bands[name] = planes
+            if offset != len(self.data):
+                raise ValueError('Encoded frame is truncated')
+        except struct.error:
+            raise ValueError('Encoded frame is truncated')
+
+    @classmethod
+    def load(cls, path, quadrants=EPD_QUADRANTS):
+        with open(path, 'rb') as frameFile:
+            return cls(frameFile.read(), quadrants)
+
+    def iter_plane(self, name, plane):
+        # Decodes the bands of a quadrant's black (0) or red (1) data one by one
+        for offset, length in self.bands[name][plane]:
+            try:
+                yield zlib.decompress(self.data[offset:offset + length])
+            except zlib.error as e:
+                raise ValueError('Encoded frame is corrupted: {}'.format(e))
+
+    def iter_wire_planes(self, quadrant):
+        return self.iter_plane(quadrant[0], 0), self.iter_plane(quadrant[0], 1)
+
+    def get_wire_plane(self, quadrant, plane):
+        return b''.join(self.iter_plane(quadrant[0], plane))
+
+    def get_wire_planes(self, quadrant):
+        return self.get_wire_plane(quadrant, 0), self.get_wire_plane(quadrant, 1)
+
+    def fit(self, width, height):
+        if (width, height) != (self.width, self.height):
+            raise ValueError('Frame is {}x{}, expected {}x{}'.format(self.width, self.height, width, height))
+        return self
+
+    def save(self, path, quadrants=EPD_QUADRANTS):
+        # Writes the decoded frame as a frame file, decoding it twice (for the CRC, then the data) instead of
+        # holding all of it
+        crc = 0
+        for quadrant in quadrants:
+            for chunks in self.iter_wire_planes(quadrant):
+                for chunk in chunks:
+                    crc = zlib.crc32(chunk, crc)
+        header = get_frame_header(self.width, self.height, quadrants, crc)
+        write_file(path, itertools.chain([header], (chunk for quadrant in quadrants
+                                                    for chunks in self.iter_wire_planes(quadrant)
+                                                    for chunk in chunks)))
+
+
+def main():
+    # Reports the size of a frame file once encoded, and how fast it is encoded and decoded
+    import os
+    import sys
+    import time
+    from display.framebuffer import FrameFile
+
+    path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(__file__), '..', 'render',
+                                                                 'calendar.fb')
+    frame = FrameFile(path)
+    rawSizes = [0, 0]
+    encodedSizes = [0, 0]
+    for quadrant in EPD_QUADRANTS:
+        for plane, data in enumerate(frame.get_wire_planes(quadrant)):
+            rawSizes[plane] += len(data)
+    rounds = 20
+
+    for bandRows in (1, 41, 492):
+        start = time.perf_counter()
+        for i in range(rounds):
+            encoded = encode_frame(frame, bandRows=bandRows)
+        encodeTime = (time.perf_counter() - start) / rounds
+        encodedFrame = EncodedFrame(encoded)
+        for plane in range(2):
+            encodedSizes[plane] = sum(length + CODEC_BAND.size for quadrant in EPD_QUADRANTS
+                                      for offset, length in encodedFrame.bands[quadrant[0]][plane])
+
+        start = time.perf_counter()
+        for i in range(rounds):
+            for quadrant in EPD_QUADRANTS:
+                for chunks in encodedFrame.iter_wire_planes(quadrant):
+                    for chunk in chunks:
+                        pass
+        decodeTime = (time.perf_counter() - start) / rounds
+
+        print('{} rows per band: {} bytes encoded from {} ({:.1f}x), black {:.1f}x, red {:.1f}x'.format(
+            bandRows, len(encoded), sum(rawSizes), sum(rawSizes) / len(encoded), rawSizes[0] / encodedSizes[0],
+            rawSizes[1] / encodedSizes[1]))
+        print('    encode {:.2f} ms, decode {:.2f} ms ({:.0f} MB/s)'.format(
+            encodeTime * 1000, decodeTime * 1000, sum(rawSizes) / decodeTime / 1e6))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Shows a frame file on the E-Ink display, without rendering anything. Only the display driver is imported, not Pillow,
+Selenium or the Google client, so this starts quickly and can run on a device that just receives the frame file
+rendered elsewhere (render/calendar.fb is written on every render).
+
+    python3 -m display.showframe render/calendar.fb     # show a frame, refreshing only the quadrants that changed
+    python3 -m display.showframe                        # repaint the last frame shown, e.g. after a crash
+    python3 -m display.showframe --calibrate 1          # calibrate, then repaint the last frame shown
+"""
+
+import argparse
+import logging
+import sys
+import display.epd12in48b as eink
+from display.display import DisplayHelper
+from display.framebuffer import FrameFile
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Show a frame file on the E-Ink display.')
+    parser.add_argument('frameFile', nargs='?', help='frame file to show, the last frame shown if omitted')
+    parser.add_argument('--calibrate', type=int, default=0, metavar='CYCLES',
+                        help='calibration cycles to run before showing the frame')
+    parser.add_argument('--backend', default=None, help="'hardware' or 'simulator'")
+    parser.add_argument('--busyWaitMode', default='poll', choices=('poll', 'edge'))
+    args = parser.parse_args()
+
+    logging.basicConfig(stream=sys.stdout, format='%(asctime)s %(levelname)s - %(message)s')
+    logging.getLogger('maginkcal').setLevel(logging.INFO)
+
+    displayService = DisplayHelper(eink.EPD_WIDTH, eink.EPD_HEIGHT, args.busyWaitMode, backend=args.backend)
+    try:
+        if args.frameFile is None:
+            if args.calibrate > 0:
+                displayService.calibrate(args.calibrate, isRepainted=True)
+            elif not displayService.repaint():
+                return 1
+        else:
+            frame = FrameFile(args.frameFile)
+            if args.calibrate > 0:
+                displayService.calibrate(args.calibrate)
+            displayService.update(frame)
+    finally:
+        displayService.sleep()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
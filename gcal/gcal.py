@@ -6,23 +6,40 @@ credentials.json and token.pickle in the same folder as this file. If not, run q
 """
 
 from __future__ import print_function
+from concurrent.futures import ThreadPoolExecutor
 import datetime as dt
+import hashlib
+import heapq
+import json
 import pickle
+import os
 import os.path
 import pathlib
+import threading
+import time
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+from gcal.timeconv import EventTimeConverter
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 import logging
 
+# Partial response with the only event fields used, the page and sync tokens have to be asked for as well
+EVENT_FIELDS = 'items(id,iCalUID,status,summary,start,end,updated),nextPageToken,nextSyncToken'
+MAX_RESULTS = 2500  # events per page, the most the API returns
+
 
 class GcalHelper:
 
-    def __init__(self):
+    def __init__(self, isIncrementalSync=False, maxWorkers=4):
         self.logger = logging.getLogger('maginkcal')
         # Initialise the Google Calendar using the provided credentials and token
         SCOPES = ['https://www.googleapis.com/auth/calendar.readonly']
         self.currPath = str(pathlib.Path(__file__).parent.absolute())
+        # isIncrementalSync keeps the events of each calendar in eventstore, and only fetches what changed since
+        self.isIncrementalSync = isIncrementalSync
+        self.storePath = self.currPath + '/eventstore'
+        self.maxWorkers = maxWorkers  # calendars fetched at the same time
 
         creds = None
         # The file token.pickle stores the user's access and refresh tokens, and is
@@ -43,7 +60,17 @@ class GcalHelper:
             with open(self.currPath + '/token.pickle', 'wb') as token:
                 pickle.dump(creds, token)
 
+        self.creds = creds
         self.service = build('calendar', 'v3', credentials=creds, cache_discovery=False)
+        self.threadLocal = threading.local()
+
+    def get_service(self):
+        # The HTTP object of a service must not be shared between threads, each fetch thread builds its own
+        service = getattr(self.threadLocal, 'service', None)
+        if service is None:
+            service = build('calendar', 'v3', credentials=self.creds, cache_discovery=False)
+            self.threadLocal.service = service
+        return service
 
     def list_calendars(self):
         # helps to retrieve ID for calendars within the account
@@ -58,80 +85,181 @@ class GcalHelper:
             cal_id = calendar['id']
             self.logger.info("%s\t%s" % (summary, cal_id))
 
-    def to_datetime(self, isoDatetime, localTZ):
-        # replace Z with +00:00 is a workaround until datetime library decides what to do with the Z notation
-        toDatetime = dt.datetime.fromisoformat(isoDatetime.replace('Z', '+00:00'))
-        return toDatetime.astimezone(localTZ)
-
-    def is_recent_updated(self, updatedTime, thresholdHours):
-        # consider events updated within the past X hours as recently updated
-        utcnow = dt.datetime.now(dt.timezone.utc)
-        diff = (utcnow - updatedTime).total_seconds() / 3600  # get difference in hours
-        return diff < thresholdHours
-
-    def adjust_end_time(self, endTime, localTZ):
-        # check if end time is at 00:00 of next day, if so set to max time for day before
-        if endTime.hour == 0 and endTime.minute == 0 and endTime.second == 0:
-            newEndtime = localTZ.localize(
-                dt.datetime.combine(endTime.date() - dt.timedelta(days=1), dt.datetime.max.time()))
-            return newEndtime
-        else:
-            return endTime
-
     def is_multiday(self, start, end):
         # check if event stretches across multiple days
         return start.date() != end.date()
 
     def retrieve_events(self, calendars, startDatetime, endDatetime, localTZ, thresholdHours):
         # Call the Google Calendar API and return a list of events that fall within the specified dates
-        eventList = []
-
         minTimeStr = startDatetime.isoformat()
         maxTimeStr = endDatetime.isoformat()
-        if False:
-            return eventList
 
         self.logger.info('Retrieving events between ' + minTimeStr + ' and ' + maxTimeStr + '...')
-        events_result = []
-        for cal in calendars:
-            events_result.append(
-                self.service.events().list(calendarId=cal, timeMin=minTimeStr,
-                                           timeMax=maxTimeStr, singleEvents=True,
-                                           orderBy='startTime').execute()
-            )
+        converter = EventTimeConverter(localTZ, thresholdHours)  # converts the timestamps of all the events
+        # each calendar's events come in start time order, they are normalised as the merge reaches them
+        streams = [(self.normalise_event(event, converter) for event in calendarEvents)
+                   for calendarEvents in self.fetch_calendars(calendars, startDatetime, endDatetime, converter)]
+        eventList = list(self.merge_event_streams(streams))
+        if not eventList:
+            self.logger.info('No upcoming events found.')
+        return eventList
+
+    def merge_event_streams(self, streams):
+        # Merges the start time ordered event streams of the calendars into one, keeping the calendar order for
+        # events starting at the same time, and drops the copies of an event shown in more than one calendar
+        # copies have the same start, so only the events of the current start time are kept to compare with
+        seenStart = None
+        seenEvents = set()
+        for event in heapq.merge(*streams, key=lambda k: k['startDatetime']):
+            if event['startDatetime'] != seenStart:
+                seenStart = event['startDatetime']
+                seenEvents.clear()
+            if event['iCalUID'] is not None:
+                if event['iCalUID'] in seenEvents:
+                    continue
+                seenEvents.add(event['iCalUID'])
+            yield event
+
+    def normalise_event(self, event, converter):
+        # extracting and converting the data of an event resource, as the renderer takes it
+        # converter is the EventTimeConverter of the display's timezone
+        newEvent = {}
+        newEvent['summary'] = event['summary']
+        newEvent['iCalUID'] = event.get('iCalUID')  # the same in every calendar the event is in
 
+        if event['start'].get('dateTime') is None:
+            newEvent['allday'] = True
+            newEvent['startDatetime'] = converter.to_datetime(event['start'].get('date'))
+        else:
+            newEvent['allday'] = False
+            newEvent['startDatetime'] = converter.to_datetime(event['start'].get('dateTime'))
+
+        if event['end'].get('dateTime') is None:
+            newEvent['endDatetime'] = converter.adjust_end_time(converter.to_datetime(event['end'].get('date')))
+        else:
+            newEvent['endDatetime'] = converter.adjust_end_time(converter.to_datetime(event['end'].get('dateTime')))
+
+        newEvent['updatedDatetime'] = converter.to_datetime(event['updated'])
+        newEvent['isUpdated'] = converter.is_recent_updated(newEvent['updatedDatetime'])
+        newEvent['isMultiday'] = self.is_multiday(newEvent['startDatetime'], newEvent['endDatetime'])
+        return newEvent
+
+    def iter_pages(self, calendarId, **params):
+        # Yields the pages of events().list with params, the next page is only requested once this one is used
+        service = self.get_service()
+        request = service.events().list(calendarId=calendarId, singleEvents=True, maxResults=MAX_RESULTS,
+                                        fields=EVENT_FIELDS, **params)
+        while request is not None:
+            response = request.execute()
+            yield response
+            request = service.events().list_next(request, response)
+
+    def fetch_calendars(self, calendars, startDatetime, endDatetime, converter):
+        # Fetches the events of the calendars in a pool of maxWorkers threads, so the time spent waiting for
+        # the API does not add up calendar by calendar
+        # Returns the event list of each calendar in turn, empty for a calendar that could not be fetched
+        with ThreadPoolExecutor(max_workers=max(1, min(self.maxWorkers, len(calendars)))) as executor:
+            futures = [executor.submit(self.fetch_calendar, cal, startDatetime, endDatetime, converter)
+                       for cal in calendars]
+        results = []
+        for cal, future in zip(calendars, futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                # one calendar failing still lets the others be shown
+                self.logger.error('Calendar {}: events could not be retrieved: {}'.format(cal, e))
+                results.append([])
+        return results
+
+    def fetch_calendar(self, calendarId, startDatetime, endDatetime, converter):
+        # Returns the events of a calendar between the dates, as listed by the API
+        start = time.perf_counter()
+        if self.isIncrementalSync:
+            events = self.get_synced_events(calendarId, startDatetime, endDatetime, converter)
+        else:
+            events = []
+            for page in self.iter_pages(calendarId, timeMin=startDatetime.isoformat(),
+                                        timeMax=endDatetime.isoformat(), orderBy='startTime'):
+                events += page.get('items', [])
+        self.logger.info('Calendar {}: {} events retrieved in {:.3f}s.'.format(calendarId, len(events),
+                                                                              time.perf_counter() - start))
+        return events
+
+    def get_synced_events(self, calendarId, startDatetime, endDatetime, converter):
+        # Brings the stored events of a calendar up to date, and returns those between the dates as the API would,
+        # in start time order
+        store = self.load_event_store(calendarId)
+        if store is not None and dt.datetime.fromisoformat(store['timeMin']) > startDatetime:
+            store = None  # the store starts after the dates asked for
+        if store is not None:
+            syncToken = store['syncToken']
+            try:
+                changeCount = self.sync_events(calendarId, store, syncToken=syncToken)
+                self.logger.info('Calendar {}: {} changed events synced.'.format(calendarId, changeCount))
+                isChanged = changeCount > 0 or store['syncToken'] != syncToken
+            except HttpError as e:
+                if e.resp.status != 410:
+                    raise
+                self.logger.info('Calendar {}: sync token expired, syncing all events again.'.format(calendarId))
+                store = None
+        if store is None:
+            store = {'calendarId': calendarId, 'timeMin': startDatetime.isoformat(), 'syncToken': None, 'events': {}}
+            changeCount = self.sync_events(calendarId, store, timeMin=store['timeMin'])
+            self.logger.info('Calendar {}: all {} events synced.'.format(calendarId, changeCount))
+            isChanged = True
+
+        # an event is within the dates if it ends after the start and starts before the end, like timeMin and timeMax
+        # the dates only move forward, events that ended before the start are dropped from the store
         events = []
-        for eve in events_result:
-            events += eve.get('items', [])
-            # events = events_result.get('items', [])
+        for eventId, event in list(store['events'].items()):
+            start = converter.to_datetime(event['start'].get('dateTime', event['start'].get('date')))
+            end = converter.to_datetime(event['end'].get('dateTime', event['end'].get('date')))
+            if end <= startDatetime:
+                del store['events'][eventId]
+                isChanged = True
+            elif start < endDatetime:
+                events.append((start, event))
+        if store['timeMin'] != startDatetime.isoformat():
+            store['timeMin'] = startDatetime.isoformat()
+            isChanged = True
+        if isChanged:
+            self.save_event_store(calendarId, store)
+        events.sort(key=lambda k: k[0])
+        return [event for start, event in events]
 
-        if not events:
-            self.logger.info('No upcoming events found.')
-        for event in events:
-            # extracting and converting events data into a new list
-            newEvent = {}
-            newEvent['summary'] = event['summary']
-
-            if event['start'].get('dateTime') is None:
-                newEvent['allday'] = True
-                newEvent['startDatetime'] = self.to_datetime(event['start'].get('date'), localTZ)
-            else:
-                newEvent['allday'] = False
-                newEvent['startDatetime'] = self.to_datetime(event['start'].get('dateTime'), localTZ)
+    def sync_events(self, calendarId, store, **params):
+        # Applies the events listed with params (a syncToken, or timeMin for a full sync) to store, following every
+        # page, and keeps the sync token of the last page for the next sync. Returns the number of events changed.
+        changeCount = 0
+        for page in self.iter_pages(calendarId, **params):
+            for event in page.get('items', []):
+                if event.get('status') == 'cancelled':
+                    store['events'].pop(event['id'], None)
+                else:
+                    store['events'][event['id']] = event
+                changeCount += 1
+            store['syncToken'] = page.get('nextSyncToken', store['syncToken'])
+        return changeCount
 
-            if event['end'].get('dateTime') is None:
-                newEvent['endDatetime'] = self.adjust_end_time(self.to_datetime(event['end'].get('date'), localTZ),
-                                                               localTZ)
-            else:
-                newEvent['endDatetime'] = self.adjust_end_time(self.to_datetime(event['end'].get('dateTime'), localTZ),
-                                                               localTZ)
+    def get_event_store_file(self, calendarId):
+        # calendar ids are e-mail addresses or long generated ids, the file is named after their hash
+        return '{}/{}.json'.format(self.storePath, hashlib.sha1(calendarId.encode('utf-8')).hexdigest())
 
-            newEvent['updatedDatetime'] = self.to_datetime(event['updated'], localTZ)
-            newEvent['isUpdated'] = self.is_recent_updated(newEvent['updatedDatetime'], thresholdHours)
-            newEvent['isMultiday'] = self.is_multiday(newEvent['startDatetime'], newEvent['endDatetime'])
-            eventList.append(newEvent)
+    def load_event_store(self, calendarId):
+        # Returns the stored events and sync token of a calendar, or None if there is no usable store
+        try:
+            with open(self.get_event_store_file(calendarId), 'r') as storeFile:
+                store = json.load(storeFile)
+        except (OSError, ValueError):
+            return None
+        if store.get('calendarId') != calendarId or not store.get('syncToken'):
+            return None
+        return store
 
-        # We need to sort eventList because the event will be sorted in "calendar order" instead of hours order
-        # TODO: improve because of double cycle for now is not much cost
-        eventList = sorted(eventList, key=lambda k: k['startDatetime'])
-        return eventList
+    def save_event_store(self, calendarId, store):
+        # write to a temporary file first, so an interrupted write never leaves a partial store behind
+        storeFile = self.get_event_store_file(calendarId)
+        os.makedirs(self.storePath, exist_ok=True)
+        with open(storeFile + '.tmp', 'w') as file:
+            json.dump(store, file)
+        os.replace(storeFile + '.tmp', storeFile)
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Converts the timestamps of Google Calendar events to the display's timezone, for all the events of a run at once.
+Converting each timestamp on its own makes pytz look up the UTC offset again for every one of them, and the current
+time is read again for every event. Here "now" is taken once, the offset of the display's timezone is looked up once
+per DST period, and all-day dates are turned into the local midnight (or end of the day before) once per date.
+
+    python3 -m gcal.timeconv    # converts 20000 generated events both ways and compares the time taken
+"""
+
+import bisect
+import datetime as dt
+
+
+class EventTimeConverter:
+
+    def __init__(self, localTZ, thresholdHours, now=None):
+        # events updated within thresholdHours before now are recently updated
+        self.localTZ = localTZ
+        self.now = now or dt.datetime.now(dt.timezone.utc)
+        self.updatedSince = self.now - dt.timedelta(hours=thresholdHours)
+        # pytz zones with DST list the UTC times at which the offset changes, other zones are converted as they are
+        transitions = getattr(localTZ, '_utc_transition_times', None)
+        self.transitions = None
+        if transitions is not None:
+            self.transitions = [transition.replace(tzinfo=dt.timezone.utc).timestamp() for transition in transitions]
+        self.zones = {}  # fixed offset timezone of the local time after each transition, by transition
+        self.dates = {}  # local midnight of all-day dates
+        self.dayEnds = {}  # end of the day before, for all-day end dates
+
+    def to_datetime(self, isoDatetime):
+        # Converts a dateTime (with a UTC offset or Z) or an all-day date (the local midnight) to the local timezone
+        # The local times have a fixed offset timezone with the zone's abbreviation, converting to it and comparing
+        # such times is done in C, where a pytz timezone calls back into Python each time
+        if len(isoDatetime) == 10:
+            return self.get_date(isoDatetime)
+        if isoDatetime[-1] == 'Z':
+            isoDatetime = isoDatetime[:-1] + '+00:00'
+        toDatetime = dt.datetime.fromisoformat(isoDatetime)
+        if self.transitions is None:
+            return toDatetime.astimezone(self.localTZ)
+        transition = bisect.bisect_right(self.transitions, toDatetime.timestamp())
+        zone = self.zones.get(transition)
+        if zone is None:
+            zone = self.zones[transition] = self.get_fixed_zone(toDatetime.astimezone(self.localTZ))
+        return toDatetime.astimezone(zone)
+
+    def get_fixed_zone(self, localDatetime):
+        return dt.timezone(localDatetime.utcoffset(), localDatetime.tzname())
+
+    def get_date(self, isoDate):
+        localDate = self.dates.get(isoDate)
+        if localDate is None:
+            localDate = self.dates[isoDate] = self.localize(dt.datetime(int(isoDate[0:4]), int(isoDate[5:7]),
+                                                                        int(isoDate[8:10])))
+        return localDate
+
+    def localize(self, localDatetime):
+        if not hasattr(self.localTZ, 'localize'):
+            return localDatetime.replace(tzinfo=self.localTZ)
+        localDatetime = self.localTZ.localize(localDatetime)
+        if self.transitions is None:
+            return localDatetime
+        return localDatetime.replace(tzinfo=self.get_fixed_zone(localDatetime))
+
+    def adjust_end_time(self, endTime):
+        # check if end time is at 00:00 of next day, if so set to max time for day before
+        if endTime.hour == 0 and endTime.minute == 0 and endTime.second == 0:
+            endDate = endTime.date()
+            dayEnd = self.dayEnds.get(endDate)
+            if dayEnd is None:
+                dayEnd = self.dayEnds[endDate] = self.localize(
+                    dt.datetime.combine(endDate - dt.timedelta(days=1), dt.datetime.max.time()))
+            return dayEnd
+        else:
+            return endTime
+
+    def is_recent_updated(self, updatedTime):
+        return updatedTime > self.updatedSince
+
+
+def convert_each(event, localTZ, thresholdHours):
+    # The conversion GcalHelper did for each event before, for comparison
+    def to_datetime(isoDatetime):
+        return dt.datetime.fromisoformat(isoDatetime.replace('Z', '+00:00')).astimezone(localTZ)
+
+    def adjust_end_time(endTime):
+        if endTime.hour == 0 and endTime.minute == 0 and endTime.second == 0:
+            return localTZ.localize(dt.datetime.combine(endTime.date() - dt.timedelta(days=1),
+                                                        dt.datetime.max.time()))
+        return endTime
+
+    start = to_datetime(event['start'].get('dateTime') or event['start'].get('date'))
+    end = adjust_end_time(to_datetime(event['end'].get('dateTime') or event['end'].get('date')))
+    updated = to_datetime(event['updated'])
+    isUpdated = (dt.datetime.now(dt.timezone.utc) - updated).total_seconds() / 3600 < thresholdHours
+    return start, end, updated, isUpdated
+
+
+def convert_batch(event, converter):
+    start = converter.to_datetime(event['start'].get('dateTime') or event['start'].get('date'))
+    end = converter.adjust_end_time(converter.to_datetime(event['end'].get('dateTime') or event['end'].get('date')))
+    updated = converter.to_datetime(event['updated'])
+    return start, end, updated, converter.is_recent_updated(updated)
+
+
+def main():
+    # Converts generated events with both conversions, the all-day dates only agree when the system timezone is
+    # the display's, as on the Raspberry Pi, so the process timezone is set to it
+    import os
+    import random
+    import sys
+    import time
+    from pytz import timezone
+
+    tzName = sys.argv[1] if len(sys.argv) > 1 else 'Europe/London'  # a timezone with DST
+    eventCount = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    os.environ['TZ'] = tzName
+    time.tzset()
+    localTZ = timezone(tzName)
+
+    random.seed(0)
+    base = dt.datetime(2026, 9, 1, tzinfo=dt.timezone.utc)
+    events = []
+    for i in range(eventCount):
+        start = base + dt.timedelta(minutes=30 * random.randrange(24 * 2 * 120))
+        updated = base - dt.timedelta(seconds=random.randrange(86400 * 30))
+        event = {'updated': updated.strftime('%Y-%m-%dT%H:%M:%S.') + '{:03d}Z'.format(random.randrange(1000))}
+        if random.random() < 0.2:
+            startDate = start.date()
+            event['start'] = {'date': startDate.isoformat()}
+            event['end'] = {'date': (startDate + dt.timedelta(days=random.randrange(1, 4))).isoformat()}
+        else:
+            offset = dt.timezone(dt.timedelta(hours=random.choice((-5, 0, 1, 8))))
+            end = start + dt.timedelta(minutes=30 * random.randrange(1, 8))
+            event['start'] = {'dateTime': start.astimezone(offset).isoformat()}
+            event['end'] = {'dateTime': end.astimezone(offset).isoformat()}
+        events.append(event)
+
+    now = dt.datetime.now(dt.timezone.utc)
+    start = time.perf_counter()
+    eachResults = [convert_each(event, localTZ, 24) for event in events]
+    eachTime = time.perf_counter() - start
+    start = time.perf_counter()
+    converter = EventTimeConverter(localTZ, 24, now)
+    batchResults = [convert_batch(event, converter) for event in events]
+    batchTime = time.perf_counter() - start
+
+    mismatches = sum(1 for each, batch in zip(eachResults, batchResults)
+                     if each != batch or [d.isoformat() for d in each[:3]] != [d.isoformat() for d in batch[:3]])
+    print('{} events in {}: each {:.1f} ms, batch {:.1f} ms ({:.1f}x), {} mismatches'.format(
+        eventCount, tzName, eachTime * 1000, batchTime * 1000, eachTime / batchTime, mismatches))
+    print('    {} UTC offsets, {} dates and {} day ends looked up'.format(
+        len(converter.zones), len(converter.dates), len(converter.dayEnds)))
+
+
+if __name__ == "__main__":
+    main()
@@ -38,7 +38,22 @@ def main():
     imageHeight = config['imageHeight'] # Height of image to be generated for display.
     rotateAngle = config['rotateAngle']  # If image is rendered in portrait orientation, angle to rotate to fit screen
     calendars = config['calendars']  # Google calendar ids
+    isIncrementalSync = config.get('isIncrementalSync', True)  # keep events locally and only fetch what changed
+    gcalMaxWorkers = config.get('gcalMaxWorkers', 4)  # calendars fetched at the same time
     is24hour = config['is24h']  # set 24 hour time
+    busyWaitMode = config.get('busyWaitMode', 'poll')  # 'poll': check each display controller in turn / 'edge': wait on all BUSY pins together
+    busySettleTime = config.get('busySettleTime', 0.2)  # seconds to wait after a display controller is no longer busy
+    displayBackend = config.get('displayBackend', 'hardware')  # 'hardware' or 'simulator' to run without the display
+    isPipelinedTransfer = config.get('isPipelinedTransfer', False)  # pack the next display quadrant while one is sent
+    calibrationCycles = config.get('calibrationCycles', 0)  # black, red and white fills per calibration, 0 = never calibrate
+    calibrationMaxRefreshes = config.get('calibrationMaxRefreshes', 7)  # refreshes before calibrating the display
+    calibrationMaxGhosting = config.get('calibrationMaxGhosting', 1.0)  # changed pixels before calibrating, 1 = panel
+    fastRefreshMaxChange = config.get('fastRefreshMaxChange', 0)  # fast refresh if at most this part of the pixels changed, 0 = never
+    fastRefreshMaxCount = config.get('fastRefreshMaxCount', 5)  # fast refreshes in a row before a full refresh
+    isPersistentBrowser = config.get('isPersistentBrowser', False)  # keep headless Chrome running between renders
+    browserMemoryLimitMB = config.get('browserMemoryLimitMB', 300)  # restart the persistent Chrome above this memory use
+    renderBackend = config.get('renderBackend', 'selenium')  # 'selenium', 'cdp' (no chromedriver) or 'pillow' (no browser)
+    renderReadyTimeout = config.get('renderReadyTimeout', 10)  # max seconds to wait for fonts/images before screenshot
 
     # Create and configure logger
     logging.basicConfig(filename="logfile.log", format='%(asctime)s %(levelname)s - %(message)s', filemode='a')
@@ -67,7 +82,7 @@ def main():
 
         # Using Google Calendar to retrieve all events within start and end date (inclusive)
         start = dt.datetime.now()
-        gcalService = GcalHelper()
+        gcalService = GcalHelper(isIncrementalSync, gcalMaxWorkers)
         eventList = gcalService.retrieve_events(calendars, calStartDatetime, calEndDatetime, displayTZ, thresholdHours)
         logger.info("Calendar events retrieved in " + str(dt.datetime.now() - start))
 
@@ -77,16 +92,22 @@ def main():
                    'dayOfWeekText': dayOfWeekText, 'weekStartDay': weekStartDay, 'maxEventsPerDay': maxEventsPerDay,
                    'is24hour': is24hour}
 
-        renderService = RenderHelper(imageWidth, imageHeight, rotateAngle)
-        calBlackImage, calRedImage = renderService.process_inputs(calDict)
+        browserSession = None
+        if isPersistentBrowser:
+            from render.browser import BrowserSession
+            browserSession = BrowserSession(memoryLimitMB=browserMemoryLimitMB)
+        renderService = RenderHelper(imageWidth, imageHeight, rotateAngle, browserSession, renderBackend,
+                                     renderReadyTimeout)
+        calFrame = renderService.process_inputs(calDict)
 
         if isDisplayToScreen:
             from display.display import DisplayHelper
-            displayService = DisplayHelper(screenWidth, screenHeight)
-            if currDate.weekday() == weekStartDay:
-                # calibrate display once a week to prevent ghosting
-                displayService.calibrate(cycles=0)  # to calibrate in production
-            displayService.update(calBlackImage, calRedImage)
+            displayService = DisplayHelper(screenWidth, screenHeight, busyWaitMode, busySettleTime,
+                                           displayBackend, isPipelinedTransfer, calibrationMaxRefreshes,
+                                           calibrationMaxGhosting, fastRefreshMaxChange, fastRefreshMaxCount)
+            if calibrationCycles > 0 and displayService.is_calibration_due():
+                displayService.calibrate(calibrationCycles)
+            displayService.update(calFrame)
             displayService.sleep()
 
         currBatteryLevel = powerService.get_battery()
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Keeps a headless Chrome running between renders, so each render does not pay for a cold start of Chromium. The
+browser is launched detached with a remote debugging port, which lets later renders (or later runs of the script)
+reattach to it instead of starting a new one. It is restarted if it crashes or its memory use grows past a limit.
+
+The same port can also be used without Selenium and chromedriver, by talking the Chrome DevTools Protocol directly
+over the page's websocket (see DevToolsClient).
+"""
+
+import json
+import logging
+import os
+import shutil
+import signal
+import subprocess
+import time
+import urllib.request
+import websocket  # websocket-client, installed along with selenium
+
+# Selenium is only imported by the methods that drive the browser through chromedriver, so DevToolsClient and the
+# cdp render backend work without it
+
+# Launch profile shared by the one-off and persistent browsers
+CHROME_ARGS = [
+    '--headless',
+    '--hide-scrollbars',
+    '--force-device-scale-factor=1',
+    '--disable-gpu',
+    '--disable-extensions',
+    '--disable-background-networking',
+    '--disable-sync',
+    '--no-first-run',
+    '--mute-audio',
+]
+CHROME_BINARIES = ['chromium-browser', 'chromium', 'google-chrome', 'google-chrome-stable']
+
+
+class BrowserSession:
+
+    def __init__(self, debugPort=9222, userDataDir='/dev/shm/maginkcal-chrome', memoryLimitMB=300, binary=None):
+        self.logger = logging.getLogger('maginkcal')
+        self.debugPort = debugPort
+        self.userDataDir = userDataDir  # on tmpfs, so the profile never touches the SD card
+        self.memoryLimitMB = memoryLimitMB
+        self.binary = binary
+        self.pidFile = userDataDir + '.pid'
+        self.driver = None
+        self.viewportSize = None  # size set by RenderHelper.set_viewport_size, kept while the browser lives
+
+    def get_binary(self):
+        if self.binary:
+            return self.binary
+        for name in CHROME_BINARIES:
+            path = shutil.which(name)
+            if path:
+                return path
+        raise RuntimeError('Cannot find a Chrome or Chromium binary')
+
+    def get_version_info(self):
+        # Returns the DevTools version information, or None if no browser listens on the debugging port
+        try:
+            url = 'http://127.0.0.1:{}/json/version'.format(self.debugPort)
+            with urllib.request.urlopen(url, timeout=1) as response:
+                return json.loads(response.read().decode('utf-8'))
+        except (OSError, ValueError):
+            return None
+
+    def is_running(self):
+        return self.get_version_info() is not None
+
+    def launch(self, timeout=30):
+        args = [self.get_binary()] + CHROME_ARGS + [
+            '--remote-debugging-port={}'.format(self.debugPort),
+            '--user-data-dir={}'.format(self.userDataDir),
+            'about:blank',
+        ]
+        # start in its own session so the browser outlives this process and can be reattached to later
+        process = subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+        with open(self.pidFile, 'w') as pidFile:
+            pidFile.write(str(process.pid))
+        deadline = time.monotonic() + timeout
+        while not self.is_running():
+            if process.poll() is not None or time.monotonic() > deadline:
+                raise RuntimeError('Chrome failed to start on port {}'.format(self.debugPort))
+            time.sleep(0.1)
+        self.viewportSize = None
+        self.logger.info('Headless Chrome started on port {}.'.format(self.debugPort))
+
+    def stop(self):
+        if self.driver is not None:
+            from selenium.common.exceptions import WebDriverException
+            try:
+                self.driver.quit()
+            except WebDriverException:
+                pass
+            self.driver = None
+        try:
+            with open(self.pidFile, 'r') as pidFile:
+                pid = int(pidFile.read().strip())
+            os.killpg(pid, signal.SIGTERM)  # the browser's process group includes its renderer processes
+        except (OSError, ValueError):
+            pass
+        try:
+            os.remove(self.pidFile)
+        except OSError:
+            pass
+        deadline = time.monotonic() + 10
+        while self.is_running() and time.monotonic() < deadline:
+            time.sleep(0.1)
+        self.viewportSize = None
+
+    def restart(self):
+        self.logger.info('Restarting headless Chrome.')
+        self.stop()
+        self.launch()
+
+    def get_memory_mb(self):
+        # Resident memory of all processes using our profile directory, i.e. the browser and its children
+        totalKB = 0
+        marker = '--user-data-dir={}'.format(self.userDataDir).encode('utf-8')
+        for pid in os.listdir('/proc'):
+            if not pid.isdigit():
+                continue
+            try:
+                with open('/proc/{}/cmdline'.format(pid), 'rb') as cmdlineFile:
+                    if marker not in cmdlineFile.read():
+                        continue
+                with open('/proc/{}/status'.format(pid), 'r') as statusFile:
+                    for line in statusFile:
+                        if line.startswith('VmRSS:'):
+                            totalKB += int(line.split()[1])
+                            break
+            except OSError:
+                continue
+        return totalKB / 1024
+
+    def get_page_websocket_url(self):
+        # Returns the DevTools websocket of the first open page, opening a new page if there is none
+        baseUrl = 'http://127.0.0.1:{}/json'.format(self.debugPort)
+        with urllib.request.urlopen(baseUrl + '/list', timeout=5) as response:
+            targets = json.loads(response.read().decode('utf-8'))
+        for target in targets:
+            if target.get('type') == 'page' and target.get('webSocketDebuggerUrl'):
+                return target['webSocketDebuggerUrl']
+        request = urllib.request.Request(baseUrl + '/new?about:blank', method='PUT')
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return json.loads(response.read().decode('utf-8'))['webSocketDebuggerUrl']
+
+    def get_devtools(self):
+        # Returns a DevToolsClient connected to a page of the running browser, starting the browser when needed
+        if not self.is_running():
+            self.launch()
+        elif self.memoryLimitMB and self.get_memory_mb() > self.memoryLimitMB:
+            self.logger.info('Headless Chrome uses more than {} MB.'.format(self.memoryLimitMB))
+            self.restart()
+        return DevToolsClient(self.get_page_websocket_url())
+
+    def get_driver(self):
+        # Returns a WebDriver attached to the running browser, starting or restarting the browser when needed
+        from selenium import webdriver
+        from selenium.common.exceptions import WebDriverException
+        from selenium.webdriver.chrome.options import Options
+        if not self.is_running():
+            self.driver = None
+            self.launch()
+        elif self.memoryLimitMB and self.get_memory_mb() > self.memoryLimitMB:
+            self.logger.info('Headless Chrome uses more than {} MB.'.format(self.memoryLimitMB))
+            self.restart()
+
+        if self.driver is not None:
+            try:
+                self.driver.current_url  # check that the WebDriver session still works
+                return self.driver
+            except WebDriverException:
+                self.driver = None
+
+        opts = Options()
+        opts.debugger_address = '127.0.0.1:{}'.format(self.debugPort)
+        self.driver = webdriver.Chrome(options=opts)
+        return self.driver
+
+
+class DevToolsClient:
+
+    def __init__(self, webSocketUrl, timeout=30):
+        self.ws = websocket.create_connection(webSocketUrl, timeout=timeout, suppress_origin=True)
+        self.lastId = 0
+
+    def call(self, method, **params):
+        # Sends a DevTools command and waits for its result, events received in the meantime are ignored
+        self.lastId += 1
+        self.ws.send(json.dumps({'id': self.lastId, 'method': method, 'params': params}))
+        while True:
+            message = json.loads(self.ws.recv())
+            if message.get('id') != self.lastId:
+                continue
+            if 'error' in message:
+                raise RuntimeError('{} failed: {}'.format(method, message['error'].get('message')))
+            return message.get('result', {})
+
+    def close(self):
+        self.ws.close()
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Assigns events to the days of the calendar grid. Each event is treated as an interval of day numbers (ordinal dates)
+and added to every day it spans, clamped to the days shown, so a multi-day event also appears on the days between its
+first and last day. Events are sorted once before they are distributed, so every day ends up in display order without
+being sorted on its own, and the "+N more" count of each day is worked out up front.
+"""
+
+from datetime import timedelta
+
+
+def get_sort_key(event):
+    # All-day events first, then multi-day events, then by start time
+    return not event['allday'], not event['isMultiday'], event['startDatetime']
+
+
+class DayBuckets:
+
+    def __init__(self, calStartDate, events, maxEventsPerDay, numDays=35):
+        self.calStartDate = calStartDate
+        self.numDays = numDays
+        self.dates = [calStartDate + timedelta(days=i) for i in range(numDays)]
+        self.days = [[] for i in range(numDays)]  # all events of each day, in display order
+
+        firstOrdinal = calStartDate.toordinal()
+        lastDay = numDays - 1
+        for event in sorted(events, key=get_sort_key):
+            startDay = event['startDatetime'].toordinal() - firstOrdinal
+            endDay = event['endDatetime'].toordinal() - firstOrdinal if event['isMultiday'] else startDay
+            if endDay < 0 or startDay > lastDay:
+                continue
+            for day in range(max(startDay, 0), min(max(endDay, startDay), lastDay) + 1):
+                self.days[day].append(event)
+
+        self.visible = [day[:maxEventsPerDay] for day in self.days]  # events shown in each day
+        self.overflow = [max(len(day) - maxEventsPerDay, 0) for day in self.days]  # number of events left out
+
+    def __len__(self):
+        return self.numDays
+
+    def is_first_day(self, event, day):
+        # True on the day an event starts, False on the following days of a multi-day event
+        return event['startDatetime'].date() == self.dates[day]
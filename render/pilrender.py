@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Draws the calendar directly with Pillow, as an alternative to rendering calendar_template.html in headless Chrome.
+The layout follows styles.css (5x7 grid, month header, battery icon, day names, date circle for today, events and
+"+N more") at the same 16px rem, using the bundled Quattrocento fonts. Black and red are drawn on separate canvases,
+in the grey level each CSS colour has in Chrome's screenshot, so muted and red ink are dithered the same way when
+the canvases are converted to 1-bit images.
+
+This needs neither Chrome nor Selenium, which is useful when the browser runs out of memory on a Pi Zero, and
+renders in under a second on a desktop PC. Use compare_images to check the output against a Chrome screenshot of the same inputs.
+"""
+
+import pathlib
+from PIL import Image, ImageChops, ImageDraw, ImageFont
+
+REM = 16  # px, Chrome's default font size
+
+# Grey level (as converted by Pillow from the RGB screenshot) of the colours used in the stylesheets
+INK_TEXT = 37       # body text, #212529
+INK_MUTED = 115     # .text-muted, #6c757d
+INK_DANGER = 105    # .text-danger, #dc3545 (red plane)
+INK_CIRCLE = 76     # .datecircle, #ff0000 (red plane)
+PAPER = 255
+
+# Vertical layout of the calendar, following the stylesheets
+PADDING = 1 * REM                      # .p-3
+MONTH_HEIGHT = 13 * REM * 1.2          # .month font-size and h3 line-height
+DAY_NAMES_HEIGHT = 1 * REM + 3.5 * REM * 1.2 + 2 * REM + 1 * REM  # li margins, line height and ol margin-bottom
+DAY_HEIGHT = 11.5 * REM                # .days li min-height
+DATE_HEIGHT = 3 * REM + 1 * REM        # .date line height and margins, or the 4rem .datecircle
+EVENT_HEIGHT = 1 * REM * 1.5 + 0.2 * REM + 1  # line height, padding and margin-bottom
+EVENT_PADDING = 0.1 * REM
+
+BATTERY_POSITION = (925, 5)
+BATTERY_SIZE = (53, 27)
+BATTERY_OFFSETS = {'battery80': 0, 'battery60': 44, 'battery40': 89, 'battery20': 134, 'battery0': 178}
+
+
+class PillowRenderer:
+
+    def __init__(self, width, height):
+        self.currPath = str(pathlib.Path(__file__).parent.absolute())
+        self.imageWidth = width
+        self.imageHeight = height
+        self.fonts = {}
+
+    def get_font(self, name, size):
+        if (name, size) not in self.fonts:
+            self.fonts[(name, size)] = ImageFont.truetype(self.currPath + '/' + name + '.ttf', size)
+        return self.fonts[(name, size)]
+
+    def fit_text(self, text, font, maxWidth):
+        # Truncates text with an ellipsis to fit maxWidth, like text-overflow: ellipsis
+        if font.getlength(text) <= maxWidth:
+            return text
+        while text and font.getlength(text + '…') > maxWidth:
+            text = text[:-1]
+        return text + '…'
+
+    def draw_arrow(self, draw, x, y, size, ink, isRight):
+        # Quattrocento has no ► / ◄ glyphs, so the multi-day markers are drawn as triangles
+        top, bottom, middle = y - size / 2, y + size / 2, y
+        if isRight:
+            draw.polygon([(x, top), (x, bottom), (x + size * 0.9, middle)], fill=ink)
+        else:
+            draw.polygon([(x + size * 0.9, top), (x + size * 0.9, bottom), (x, middle)], fill=ink)
+        return size * 0.9 + 2
+
+    def draw_battery(self, black, battText):
+        if battText not in BATTERY_OFFSETS:
+            return
+        battery = Image.open(self.currPath + '/battery.png').convert('RGBA')
+        offset = BATTERY_OFFSETS[battText]
+        icon = battery.crop((0, offset, BATTERY_SIZE[0], offset + BATTERY_SIZE[1]))
+        black.paste(icon.convert('L'), BATTERY_POSITION, icon)
+
+    def render(self, calDict, dayBuckets, battText, formatTime):
+        # dayBuckets holds the events of each of the 35 days, see render.daybuckets.DayBuckets
+        # formatTime formats the start time of timed events, e.g. RenderHelper.get_short_time
+        black = Image.new('L', (self.imageWidth, self.imageHeight), PAPER)
+        red = Image.new('L', (self.imageWidth, self.imageHeight), PAPER)
+        blackDraw = ImageDraw.Draw(black)
+        redDraw = ImageDraw.Draw(red)
+
+        today = calDict['today']
+        columnWidth = (self.imageWidth - 2 * PADDING) / 7
+        centre = self.imageWidth / 2
+
+        # Month header and battery icon
+        y = PADDING
+        blackDraw.text((centre, y + MONTH_HEIGHT / 2), str(today.month).upper(),
+                       font=self.get_font('Quattrocento-Bold', 13 * REM), fill=INK_TEXT, anchor='mm')
+        self.draw_battery(black, battText)
+        y += MONTH_HEIGHT
+
+        # Day of week row
+        dayNameFont = self.get_font('Quattrocento-Bold', int(3.5 * REM))
+        for i in range(7):
+            text = calDict['dayOfWeekText'][(i + calDict['weekStartDay']) % 7].upper()
+            blackDraw.text((PADDING + (i + 0.5) * columnWidth, y + REM + 3.5 * REM * 1.2 / 2), text,
+                           font=dayNameFont, fill=INK_TEXT, anchor='mm')
+        y += DAY_NAMES_HEIGHT
+
+        # Dates and events
+        dateFont = self.get_font('Quattrocento-Bold', 3 * REM)
+        circleFont = self.get_font('Quattrocento-Regular', 3 * REM)
+        eventFont = self.get_font('Quattrocento-Regular', REM)
+        for i in range(len(dayBuckets)):
+            currDate = dayBuckets.dates[i]
+            isOtherMonth = currDate.month != today.month
+            left = PADDING + (i % 7) * columnWidth
+            top = y + (i // 7) * DAY_HEIGHT
+            dateCentre = (left + columnWidth / 2, top + DATE_HEIGHT / 2)
+            if currDate == today:
+                radius = 2 * REM
+                redDraw.ellipse((dateCentre[0] - radius, top, dateCentre[0] + radius, top + 2 * radius),
+                                fill=INK_CIRCLE)
+                redDraw.text((dateCentre[0], top + radius), str(currDate.day), font=circleFont, fill=PAPER,
+                             anchor='mm')
+            else:
+                blackDraw.text(dateCentre, str(currDate.day), font=dateFont,
+                               fill=INK_MUTED if isOtherMonth else INK_TEXT, anchor='mm')
+
+            eventTop = top + DATE_HEIGHT
+            for event in dayBuckets.visible[i]:
+                if event['isUpdated']:
+                    draw, ink = redDraw, INK_DANGER
+                else:
+                    draw, ink = blackDraw, INK_MUTED if isOtherMonth else INK_TEXT
+                x = left + EVENT_PADDING
+                middle = eventTop + EVENT_HEIGHT / 2
+                if event['isMultiday']:
+                    x += self.draw_arrow(draw, x, middle, 0.6 * REM, ink, dayBuckets.is_first_day(event, i))
+                    text = event['summary']
+                elif event['allday']:
+                    text = event['summary']
+                else:
+                    text = formatTime(event['startDatetime']) + ' ' + event['summary']
+                text = self.fit_text(text, eventFont, left + columnWidth - EVENT_PADDING - x)
+                draw.text((x, middle), text, font=eventFont, fill=ink, anchor='lm')
+                eventTop += EVENT_HEIGHT
+            if dayBuckets.overflow[i]:
+                blackDraw.text((left + EVENT_PADDING, eventTop + EVENT_HEIGHT / 2),
+                               str(dayBuckets.overflow[i]) + ' more', font=eventFont, fill=INK_MUTED,
+                               anchor='lm')
+
+        # greyscale canvases, rotated and dithered when they are packed like the Chrome screenshot
+        return black, red
+
+
+def compare_images(images, referenceImages, diffFile=None):
+    # Returns the fraction of pixels that differ in the black and red images, compared to the reference images
+    # (e.g. the Chrome output for the same inputs). diffFile optionally saves the differences, red for the red plane
+    ratios = []
+    diffs = []
+    for image, reference in zip(images, referenceImages):
+        plane = image.convert('1')
+        referencePlane = reference.convert('1').resize(plane.size)
+        diff = ImageChops.logical_xor(plane, referencePlane)
+        diffs.append(diff)
+        ratios.append(diff.histogram()[255] / (plane.size[0] * plane.size[1]))
+    if diffFile is not None:
+        diffImage = Image.new('RGB', diffs[0].size, 'white')
+        diffImage.paste((0, 0, 0), mask=diffs[0])
+        diffImage.paste((255, 0, 0), mask=diffs[1])
+        diffImage.save(diffFile)
+    return tuple(ratios)
@@ -11,27 +11,58 @@ calendar and refreshing of the eInk display. In the future, I might choose to ge
 RPi device, while using a ESP32 or PiZero purely to just retrieve the image from a file host and update the screen.
 """
 
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
-from time import sleep
-from datetime import timedelta
+from display.framebuffer import FrameBuffer
+from render.pilrender import PillowRenderer, compare_images
+from render.daybuckets import DayBuckets
+from render.template import CalendarTemplate, build_calendar_html
+from time import perf_counter
+import base64
+import hashlib
+import io
+import os
 import pathlib
 from PIL import Image
 import logging
 
+try:
+    import numpy as np  # optional, used to speed up the colour separation of the screenshot
+except ImportError:
+    np = None
+
+SPLIT_BAND_ROWS = 64  # rows of the screenshot split_colours_numpy classifies at once
+
+# Resolves once the page has loaded, its web fonts are ready and every image is decoded
+READY_PROMISE_JS = """
+new Promise(resolve => {
+    if (document.readyState === 'complete') { resolve(); }
+    else { window.addEventListener('load', () => resolve(), {once: true}); }
+}).then(() => document.fonts.ready)
+  .then(() => Promise.all(Array.from(document.images).map(img => img.decode().catch(() => null))))
+  .then(() => true)
+"""
+
 
 class RenderHelper:
 
-    def __init__(self, width, height, angle):
+    def __init__(self, width, height, angle, browserSession=None, renderBackend='selenium', readyTimeout=10):
+        # browserSession is an optional render.browser.BrowserSession, which keeps Chrome running between renders
+        # renderBackend is 'selenium' (through chromedriver), 'cdp' (Chrome DevTools Protocol, without chromedriver)
+        # or 'pillow' (drawn directly with Pillow, without a browser)
+        # readyTimeout is the longest time in seconds to wait for fonts, stylesheets and images before the screenshot
         self.logger = logging.getLogger('maginkcal')
         self.currPath = str(pathlib.Path(__file__).parent.absolute())
         self.htmlFile = 'file://' + self.currPath + '/calendar.html'
+        self.frameFile = self.currPath + '/calendar.fb'  # latest frame, ready for display.showframe
         self.imageWidth = width
         self.imageHeight = height
         self.rotateAngle = angle
+        self.browserSession = browserSession
+        self.renderBackend = renderBackend
+        self.readyTimeout = readyTimeout
+        self.pillowRenderer = PillowRenderer(width, height)
 
     def set_viewport_size(self, driver):
+        from selenium.webdriver.common.by import By
 
         # Extract the current window size from the driver
         current_window_size = driver.get_window_size()
@@ -49,42 +80,180 @@ class RenderHelper:
             width=target_width,
             height=target_height)
 
-    def get_screenshot(self):
-        opts = Options()
-        opts.add_argument("--headless")
-        opts.add_argument("--hide-scrollbars");
-        opts.add_argument('--force-device-scale-factor=1')
-        driver = webdriver.Chrome(options=opts)
-        self.set_viewport_size(driver)
-        driver.get(self.htmlFile)
-        sleep(1)
-        driver.get_screenshot_as_file(self.currPath + '/calendar.png')
-        driver.quit()
+    def capture_screenshot(self, calendarHtml):
+        # Renders the calendar in headless Chrome and returns the screenshot, which is also saved to calendar.png
+        if self.renderBackend == 'cdp':
+            screenshot = self.capture_screenshot_cdp(calendarHtml)
+        else:
+            screenshot = self.capture_screenshot_selenium()
 
+        with open(self.currPath + '/calendar.png', 'wb') as pngFile:
+            pngFile.write(screenshot)
         self.logger.info('Screenshot captured and saved to file.')
-
-        redimg = Image.open(self.currPath + '/calendar.png')  # get image)
-        rpixels = redimg.load()  # create the pixel map
-        blackimg = Image.open(self.currPath + '/calendar.png')  # get image)
-        bpixels = blackimg.load()  # create the pixel map
-
-        for i in range(redimg.size[0]):  # loop through every pixel in the image
-            for j in range(redimg.size[1]): # since both bitmaps are identical, cycle only once and not both bitmaps
-                if rpixels[i, j][0] <= rpixels[i, j][1] and rpixels[i, j][0] <= rpixels[i, j][2]:  # if is not red
-                    rpixels[i, j] = (255, 255, 255)  # change it to white in the red image bitmap
-
-                elif bpixels[i, j][0] > bpixels[i, j][1] and bpixels[i, j][0] > bpixels[i, j][2]:  # if is red
-                    bpixels[i, j] = (255, 255, 255)  # change to white in the black image bitmap
-
-        redimg = redimg.rotate(self.rotateAngle, expand=True)
-        blackimg = blackimg.rotate(self.rotateAngle, expand=True)
-
-        self.logger.info('Image colours processed. Extracted grayscale and red images.')
-        return blackimg, redimg
-
-    def get_day_in_cal(self, startDate, eventDate):
-        delta = eventDate - startDate
-        return delta.days
+        return Image.open(io.BytesIO(screenshot))
+
+    def capture_screenshot_selenium(self):
+        # Loads the calendar file through chromedriver, Selenium is imported here so the cdp and pillow backends work
+        # without it
+        from selenium import webdriver
+        from selenium.common.exceptions import WebDriverException
+        from selenium.webdriver.chrome.options import Options
+        from render.browser import CHROME_ARGS
+        if self.browserSession is None:
+            opts = Options()
+            for arg in CHROME_ARGS:
+                opts.add_argument(arg)
+            driver = webdriver.Chrome(options=opts)
+            try:
+                return self.take_screenshot(driver)
+            finally:
+                driver.quit()
+        try:
+            return self.take_screenshot(self.browserSession.get_driver())
+        except WebDriverException:
+            # the browser crashed or became unresponsive, start over with a fresh one
+            self.browserSession.restart()
+            return self.take_screenshot(self.browserSession.get_driver())
+
+    def take_screenshot(self, driver):
+        from selenium.common.exceptions import TimeoutException
+        viewportSize = (self.imageWidth, self.imageHeight)
+        if self.browserSession is None or self.browserSession.viewportSize != viewportSize:
+            self.set_viewport_size(driver)
+            if self.browserSession is not None:
+                self.browserSession.viewportSize = viewportSize
+        start = perf_counter()
+        driver.get(self.htmlFile)
+        driver.set_script_timeout(self.readyTimeout)
+        try:
+            driver.execute_async_script('const done = arguments[arguments.length - 1];' + READY_PROMISE_JS +
+                                        '.then(done);')
+            self.logger.info('Calendar ready to capture in {:.3f}s.'.format(perf_counter() - start))
+        except TimeoutException:
+            self.logger.warning('Calendar not ready after {}s, capturing anyway.'.format(self.readyTimeout))
+        return driver.get_screenshot_as_png()
+
+    def wait_until_ready_cdp(self, devtools, start):
+        # the timeout is raced in the page, as Runtime.evaluate does not bound the time spent awaiting a promise
+        expression = 'Promise.race([{}, new Promise(resolve => setTimeout(() => resolve(false), {}))])'.format(
+            READY_PROMISE_JS, int(self.readyTimeout * 1000))
+        result = devtools.call('Runtime.evaluate', expression=expression, awaitPromise=True, returnByValue=True)
+        if 'exceptionDetails' in result or result.get('result', {}).get('value') is not True:
+            self.logger.warning('Calendar not ready after {}s, capturing anyway.'.format(self.readyTimeout))
+        else:
+            self.logger.info('Calendar ready to capture in {:.3f}s.'.format(perf_counter() - start))
+
+    def capture_screenshot_cdp(self, calendarHtml):
+        # Sets the page content directly and captures the calendar viewport, without chromedriver
+        from render.browser import BrowserSession
+        browserSession = self.browserSession or BrowserSession()
+        try:
+            devtools = browserSession.get_devtools()
+        except OSError:
+            browserSession.restart()
+            devtools = browserSession.get_devtools()
+        try:
+            devtools.call('Emulation.setDeviceMetricsOverride', width=self.imageWidth, height=self.imageHeight,
+                          deviceScaleFactor=1, mobile=False)
+            frame = devtools.call('Page.getFrameTree')['frameTree']['frame']
+            if frame['url'] != self.htmlFile:
+                # the document URL is kept by setDocumentContent, so relative links resolve against the render folder
+                devtools.call('Page.navigate', url=self.htmlFile)
+                self.wait_until_ready_cdp(devtools, perf_counter())
+                frame = devtools.call('Page.getFrameTree')['frameTree']['frame']
+            start = perf_counter()
+            devtools.call('Page.setDocumentContent', frameId=frame['id'], html=calendarHtml)
+            self.wait_until_ready_cdp(devtools, start)
+            result = devtools.call('Page.captureScreenshot', format='png',
+                                   clip={'x': 0, 'y': 0, 'width': self.imageWidth, 'height': self.imageHeight,
+                                         'scale': 1})
+        finally:
+            devtools.close()
+            if self.browserSession is None:
+                browserSession.stop()
+        return base64.b64decode(result['data'])
+
+    def get_screenshot(self, calendarHtml, isCached=False):
+        # isCached reuses the screenshot from the previous run instead of starting Chrome
+        if isCached:
+            self.logger.info('Calendar unchanged since last render, screenshot skipped.')
+            calendarimg = Image.open(self.currPath + '/calendar.png')  # get image
+        else:
+            calendarimg = self.capture_screenshot(calendarHtml)
+
+        blackimg, redimg = self.split_colours(calendarimg)
+        del calendarimg
+        # the planes are greyscale, so rotating them while packing copies a third of what a colour image takes
+        calFrame = FrameBuffer.from_images(blackimg, redimg, self.rotateAngle)
+
+        self.logger.info('Image colours processed. Extracted grayscale and red planes.')
+        return calFrame
+
+    def split_colours(self, img):
+        # Separates the screenshot into a black image (red pixels whitened) and a red image (non-red pixels whitened)
+        # Both are greyscale, in the grey level Pillow dithers a colour pixel from (which truncates where
+        # convert('L') rounds), so the planes are the same as when whitened colour copies were packed, and the
+        # screenshot is the only full colour image kept
+        if img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGB')
+        if np is not None:
+            return self.split_colours_numpy(img)
+        return self.split_colours_python(img)
+
+    def split_colours_numpy(self, img):
+        # Classifies the pixel array a band of rows at a time, using the same comparisons as the pure Python loop,
+        # so the intermediate arrays stay small next to the screenshot
+        pixels = np.asarray(img)
+        blackpixels = np.empty(pixels.shape[:2], np.uint8)
+        redpixels = np.empty(pixels.shape[:2], np.uint8)
+        for top in range(0, pixels.shape[0], SPLIT_BAND_ROWS):
+            band = pixels[top:top + SPLIT_BAND_ROWS].astype(np.uint32)
+            r, g, b = band[..., 0], band[..., 1], band[..., 2]
+            grey = (r * 299 + g * 587 + b * 114) // 1000
+            blackband, redband = blackpixels[top:top + SPLIT_BAND_ROWS], redpixels[top:top + SPLIT_BAND_ROWS]
+            blackband[...] = redband[...] = grey
+            redband[(r <= g) & (r <= b)] = 255  # change it to white in the red image bitmap
+            blackband[(r > g) & (r > b)] = 255  # change to white in the black image bitmap
+        return Image.fromarray(blackpixels), Image.fromarray(redpixels)
+
+    def split_colours_python(self, img):
+        # Fallback when NumPy is not installed, reads the screenshot once and fills both greyscale images
+        black = bytearray(img.size[0] * img.size[1])
+        red = bytearray(len(black))
+
+        for i, pixel in enumerate(img.getdata()):  # loop through every pixel in the image
+            r, g, b = pixel[:3]
+            grey = (r * 299 + g * 587 + b * 114) // 1000
+            black[i] = red[i] = grey
+            if r <= g and r <= b:  # if is not red
+                red[i] = 255  # change it to white in the red image bitmap
+            elif r > g and r > b:  # if is red
+                black[i] = 255  # change to white in the black image bitmap
+        return Image.frombytes('L', img.size, bytes(black)), Image.frombytes('L', img.size, bytes(red))
+
+    def get_render_hash(self, calendarHtml):
+        # The generated HTML reflects the events, dates, battery icon and calendar settings, the remaining inputs
+        # are the image geometry and the stylesheets and images it links to
+        renderHash = hashlib.sha256(calendarHtml.encode('utf-8'))
+        renderHash.update('{}x{}@{}'.format(self.imageWidth, self.imageHeight, self.rotateAngle).encode('utf-8'))
+        for asset in ('bootstrap.min.css', 'styles.css', 'battery.png'):
+            stat = os.stat(self.currPath + '/' + asset)
+            renderHash.update('{}:{}:{}'.format(asset, stat.st_size, stat.st_mtime_ns).encode('utf-8'))
+        return renderHash.hexdigest()
+
+    def is_render_cached(self, renderHash):
+        # True if the previous screenshot was rendered from exactly the same inputs
+        if not os.path.exists(self.currPath + '/calendar.png'):
+            return False
+        try:
+            with open(self.currPath + '/calendar.hash', 'r') as hashFile:
+                return hashFile.read().strip() == renderHash
+        except OSError:
+            return False
+
+    def save_render_hash(self, renderHash):
+        with open(self.currPath + '/calendar.hash', 'w') as hashFile:
+            hashFile.write(renderHash)
 
     def get_short_time(self, datetimeObj, is24hour=False):
         datetime_str = ''
@@ -104,41 +273,9 @@ class RenderHelper:
                 datetime_str = '{}{}am'.format(str(datetimeObj.hour), datetime_str)
         return datetime_str
 
-    def process_inputs(self, calDict):
-        # calDict = {'events': eventList, 'calStartDate': calStartDate, 'today': currDate, 'lastRefresh': currDatetime, 'batteryLevel': batteryLevel}
-        # first setup list to represent the 5 weeks in our calendar
-        calList = []
-        for i in range(35):
-            calList.append([])
-
-        # retrieve calendar configuration
-        maxEventsPerDay = calDict['maxEventsPerDay']
-        batteryDisplayMode = calDict['batteryDisplayMode']
-        dayOfWeekText = calDict['dayOfWeekText']
-        weekStartDay = calDict['weekStartDay']
-        is24hour = calDict['is24hour']
-
-        # for each item in the eventList, add them to the relevant day in our calendar list
-        for event in calDict['events']:
-            idx = self.get_day_in_cal(calDict['calStartDate'], event['startDatetime'].date())
-            if idx >= 0:
-                calList[idx].append(event)
-            if event['isMultiday']:
-                idx = self.get_day_in_cal(calDict['calStartDate'], event['endDatetime'].date())
-                if idx < len(calList):
-                    calList[idx].append(event)
-
-        # Read html template
-        with open(self.currPath + '/calendar_template.html', 'r') as file:
-            calendar_template = file.read()
-
-        # Insert month header
-        month_name = str(calDict['today'].month)
-
-        # Insert battery icon
+    def get_battery_text(self, batteryDisplayMode, battLevel):
+        # Returns the class of the battery icon
         # batteryDisplayMode - 0: do not show / 1: always show / 2: show when battery is low
-        battLevel = calDict['batteryLevel']
-
         if batteryDisplayMode == 0:
             battText = 'batteryHide'
         elif batteryDisplayMode == 1:
@@ -157,55 +294,57 @@ class RenderHelper:
             battText = 'battery0'
         elif batteryDisplayMode == 2 and battLevel >= 20.0:
             battText = 'batteryHide'
+        return battText
 
-        # Populate the day of week row
-        cal_days_of_week = ''
-        for i in range(0, 7):
-            cal_days_of_week += '<li class="font-weight-bold text-uppercase">' + dayOfWeekText[
-                (i + weekStartDay) % 7] + "</li>\n"
-
-        # Populate the date and events
-        cal_events_text = ''
-        for i in range(len(calList)):
-            currDate = calDict['calStartDate'] + timedelta(days=i)
-            dayOfMonth = currDate.day
-            if currDate == calDict['today']:
-                cal_events_text += '<li><div class="datecircle">' + str(dayOfMonth) + '</div>\n'
-            elif currDate.month != calDict['today'].month:
-                cal_events_text += '<li><div class="date text-muted">' + str(dayOfMonth) + '</div>\n'
-            else:
-                cal_events_text += '<li><div class="date">' + str(dayOfMonth) + '</div>\n'
-
-            for j in range(min(len(calList[i]), maxEventsPerDay)):
-                event = calList[i][j]
-                cal_events_text += '<div class="event'
-                if event['isUpdated']:
-                    cal_events_text += ' text-danger'
-                elif currDate.month != calDict['today'].month:
-                    cal_events_text += ' text-muted'
-                if event['isMultiday']:
-                    if event['startDatetime'].date() == currDate:
-                        cal_events_text += '">►' + event['summary']
-                    else:
-                        # calHtmlList.append(' text-multiday">')
-                        cal_events_text += '">◄' + event['summary']
-                elif event['allday']:
-                    cal_events_text += '">' + event['summary']
-                else:
-                    cal_events_text += '">' + self.get_short_time(event['startDatetime'], is24hour) + ' ' + event[
-                        'summary']
-                cal_events_text += '</div>\n'
-            if len(calList[i]) > maxEventsPerDay:
-                cal_events_text += '<div class="event text-muted">' + str(len(calList[i]) - maxEventsPerDay) + ' more'
-
-            cal_events_text += '</li>\n'
-
-        # Append the bottom and write the file
+    def process_inputs(self, calDict):
+        # calDict = {'events': eventList, 'calStartDate': calStartDate, 'today': currDate, 'lastRefresh': currDatetime, 'batteryLevel': batteryLevel}
+        # returns a display.framebuffer.FrameBuffer holding the rotated black and red planes
+        # retrieve calendar configuration
+        batteryDisplayMode = calDict['batteryDisplayMode']
+        is24hour = calDict['is24hour']
+
+        # add each event to every day it covers in the 5 weeks of our calendar
+        dayBuckets = DayBuckets(calDict['calStartDate'], calDict['events'], calDict['maxEventsPerDay'])
+
+        battText = self.get_battery_text(batteryDisplayMode, calDict['batteryLevel'])
+
+        if self.renderBackend == 'pillow':
+            calBlackImage, calRedImage = self.pillowRenderer.render(
+                calDict, dayBuckets, battText, lambda datetimeObj: self.get_short_time(datetimeObj, is24hour))
+            self.logger.info('Calendar drawn with Pillow.')
+            calFrame = FrameBuffer.from_images(calBlackImage, calRedImage, self.rotateAngle)
+            calFrame.save(self.frameFile)
+            return calFrame
+
+        # Populate the template and write the file
+        calendar_template = CalendarTemplate.load(self.currPath + '/calendar_template.html')
+        calendar_html = build_calendar_html(calendar_template, calDict, dayBuckets, battText,
+                                            lambda datetimeObj: self.get_short_time(datetimeObj, is24hour))
         htmlFile = open(self.currPath + '/calendar.html', "w")
-        htmlFile.write(calendar_template.format(month=month_name, battText=battText, dayOfWeek=cal_days_of_week,
-                                                events=cal_events_text))
+        htmlFile.write(calendar_html)
         htmlFile.close()
 
-        calBlackImage, calRedImage = self.get_screenshot()
-
-        return calBlackImage, calRedImage
+        renderHash = self.get_render_hash(calendar_html)
+        isCached = self.is_render_cached(renderHash)
+        calFrame = self.get_screenshot(calendar_html, isCached)
+        calFrame.save(self.frameFile)
+        if not isCached:
+            self.save_render_hash(renderHash)
+
+        return calFrame
+
+    def compare_backends(self, calDict):
+        # Renders the same inputs with Pillow and with Chrome, and logs how many pixels differ in each plane
+        # The differences are saved to parity.png in the render folder
+        renderBackend = self.renderBackend
+        try:
+            self.renderBackend = 'pillow'
+            pillowImages = self.process_inputs(calDict).to_images()
+            self.renderBackend = 'selenium' if renderBackend == 'pillow' else renderBackend
+            chromeImages = self.process_inputs(calDict).to_images()
+        finally:
+            self.renderBackend = renderBackend
+        blackRatio, redRatio = compare_images(pillowImages, chromeImages, self.currPath + '/parity.png')
+        self.logger.info('Pillow vs Chrome render: {:.2%} of black and {:.2%} of red pixels differ.'.format(
+            blackRatio, redRatio))
+        return blackRatio, redRatio
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Builds the calendar HTML from calendar_template.html. The template is read and split around its {placeholders} once
+per process, and the page is assembled from a list of fragments joined at the end, so the cost grows linearly with the
+number of events instead of copying the document for every event appended to it.
+
+build_calendar_html is pure (no disk access), so it can be benchmarked on its own and reused by other render backends.
+"""
+
+from html import escape
+import string
+
+
+class CalendarTemplate:
+
+    cache = {}  # templates already loaded, by path
+
+    def __init__(self, templateText):
+        # parts alternate literal text and placeholder names, '{{' and '}}' are unescaped by the parser
+        self.parts = []
+        self.fields = set()
+        for literal, field, formatSpec, conversion in string.Formatter().parse(templateText):
+            if literal:
+                self.parts.append((literal, None))
+            if field is not None:
+                self.parts.append(('', field))
+                self.fields.add(field)
+
+    @classmethod
+    def load(cls, path):
+        if path not in cls.cache:
+            with open(path, 'r') as file:
+                cls.cache[path] = cls(file.read())
+        return cls.cache[path]
+
+    def render(self, **values):
+        missing = self.fields - values.keys()
+        if missing:
+            raise KeyError('Missing template values: {}'.format(', '.join(sorted(missing))))
+        return ''.join(literal if field is None else str(values[field]) for literal, field in self.parts)
+
+
+def build_day_names(dayOfWeekText, weekStartDay):
+    fragments = []
+    for i in range(0, 7):
+        fragments.append('<li class="font-weight-bold text-uppercase">')
+        fragments.append(escape(dayOfWeekText[(i + weekStartDay) % 7], quote=False))
+        fragments.append('</li>\n')
+    return ''.join(fragments)
+
+
+def build_days(calDict, dayBuckets, formatTime):
+    # dayBuckets is a render.daybuckets.DayBuckets, formatTime formats the start time of timed events
+    today = calDict['today']
+    fragments = []
+    append = fragments.append
+    for i in range(len(dayBuckets)):
+        currDate = dayBuckets.dates[i]
+        dayOfMonth = str(currDate.day)
+        isOtherMonth = currDate.month != today.month
+        if currDate == today:
+            append('<li><div class="datecircle">' + dayOfMonth + '</div>\n')
+        elif isOtherMonth:
+            append('<li><div class="date text-muted">' + dayOfMonth + '</div>\n')
+        else:
+            append('<li><div class="date">' + dayOfMonth + '</div>\n')
+
+        for event in dayBuckets.visible[i]:
+            if event['isUpdated']:
+                append('<div class="event text-danger">')
+            elif isOtherMonth:
+                append('<div class="event text-muted">')
+            else:
+                append('<div class="event">')
+            summary = escape(event['summary'], quote=False)
+            if event['isMultiday']:
+                append(('►' if dayBuckets.is_first_day(event, i) else '◄') + summary)
+            elif event['allday']:
+                append(summary)
+            else:
+                append(formatTime(event['startDatetime']) + ' ' + summary)
+            append('</div>\n')
+        if dayBuckets.overflow[i]:
+            append('<div class="event text-muted">' + str(dayBuckets.overflow[i]) + ' more')
+
+        append('</li>\n')
+    return ''.join(fragments)
+
+
+def build_calendar_html(template, calDict, dayBuckets, battText, formatTime):
+    # Returns the calendar page for the given CalendarTemplate, see RenderHelper.process_inputs for the arguments
+    return template.render(month=str(calDict['today'].month), battText=battText,
+                           dayOfWeek=build_day_names(calDict['dayOfWeekText'], calDict['weekStartDay']),
+                           events=build_days(calDict, dayBuckets, formatTime))
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Renders the calendar for several displays on one machine, and serves each display profile's latest frame file over
+HTTP, so the boards driving the panels only wake up, fetch their frame and push it (see display.fetchframe).
+
+    GET /frame/<profile>        the frame file of a profile, with a strong ETag (a hash of the frame)
+    GET /frame/<profile>.fbz    the same frame encoded with display.framecodec, for clients with little memory
+
+A request with a matching If-None-Match header gets a 304 reply without a body, which tells the client the panel
+already shows this frame and needs no refresh. Events are fetched again once they are older than serverEventMaxAge,
+and a profile is only rendered again when its calendar inputs (events, dates and settings) have changed.
+
+Profiles are read from "renderProfiles" in config.json, each with its own imageWidth, imageHeight and rotateAngle
+(and optionally renderBackend). Without it, a single "default" profile uses the main settings.
+
+    python3 -m server.server
+"""
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import datetime as dt
+import hashlib
+import json
+import logging
+import sys
+import threading
+import time
+from pytz import timezone
+from display.framecodec import encode_frame
+from render.render import RenderHelper
+
+
+class RenderServer:
+
+    def __init__(self, config, eventSource=None):
+        # eventSource(calStartDatetime, calEndDatetime) returns the event list, from Google Calendar by default
+        self.logger = logging.getLogger('maginkcal')
+        self.config = config
+        self.displayTZ = timezone(config['displayTZ'])
+        self.eventMaxAge = config.get('serverEventMaxAge', 300)  # seconds before events are fetched again
+        self.eventSource = eventSource or self.get_gcal_events
+        self.eventLock = threading.Lock()
+        self.renderLock = threading.Lock()  # the render backends share their files in the render folder
+        self.calDict = None
+        self.calDictHash = None
+        self.eventTime = None
+
+        browserSession = None
+        if config.get('isPersistentBrowser', False):
+            from render.browser import BrowserSession
+            browserSession = BrowserSession(memoryLimitMB=config.get('browserMemoryLimitMB', 300))
+        profiles = config.get('renderProfiles') or {'default': {}}
+        self.profiles = {}
+        for name, profile in profiles.items():
+            renderService = RenderHelper(profile.get('imageWidth', config['imageWidth']),
+                                         profile.get('imageHeight', config['imageHeight']),
+                                         profile.get('rotateAngle', config['rotateAngle']), browserSession,
+                                         profile.get('renderBackend', config.get('renderBackend', 'selenium')),
+                                         config.get('renderReadyTimeout', 10))
+            # frames: (etag, body) of the served frame by format, calDictHash: the inputs it was rendered from
+            self.profiles[name] = {'renderService': renderService, 'lock': threading.Lock(), 'calFrame': None,
+                                   'frames': {}, 'calDictHash': None}
+
+    def get_gcal_events(self, calStartDatetime, calEndDatetime):
+        from gcal.gcal import GcalHelper
+        gcalService = GcalHelper(self.config.get('isIncrementalSync', True), self.config.get('gcalMaxWorkers', 4))
+        return gcalService.retrieve_events(self.config['calendars'], calStartDatetime, calEndDatetime,
+                                           self.displayTZ, self.config['thresholdHours'])
+
+    def get_cal_dict(self):
+        # Returns the calendar inputs and their hash, fetching the events again when they are too old
+        with self.eventLock:
+            if self.calDict is not None and time.monotonic() - self.eventTime < self.eventMaxAge:
+                return self.calDict, self.calDictHash
+
+            # same calendar window as maginkcal.main
+            weekStartDay = self.config['weekStartDay']
+            currDatetime = dt.datetime.now(self.displayTZ)
+            currDate = currDatetime.date()
+            calStartDate = currDate - dt.timedelta(days=((currDate.weekday() + (7 - weekStartDay)) % 7))
+            calEndDate = calStartDate + dt.timedelta(days=(5 * 7 - 1))
+            calStartDatetime = self.displayTZ.localize(dt.datetime.combine(calStartDate, dt.datetime.min.time()))
+            calEndDatetime = self.displayTZ.localize(dt.datetime.combine(calEndDate, dt.datetime.max.time()))
+
+            start = time.perf_counter()
+            eventList = self.eventSource(calStartDatetime, calEndDatetime)
+            self.logger.info('{} calendar events retrieved in {:.3f}s.'.format(len(eventList),
+                                                                               time.perf_counter() - start))
+
+            # the server has no battery to report, the icon is hidden
+            calDict = {'events': eventList, 'calStartDate': calStartDate, 'today': currDate,
+                       'lastRefresh': currDatetime, 'batteryLevel': 100, 'batteryDisplayMode': 0,
+                       'dayOfWeekText': self.config['dayOfWeekText'], 'weekStartDay': weekStartDay,
+                       'maxEventsPerDay': self.config['maxEventsPerDay'], 'is24hour': self.config['is24h']}
+            self.calDict = calDict
+            self.calDictHash = self.get_cal_dict_hash(calDict)
+            self.eventTime = time.monotonic()
+            return self.calDict, self.calDictHash
+
+    def get_cal_dict_hash(self, calDict):
+        # Everything that is drawn, lastRefresh is not
+        calHash = hashlib.sha256()
+        for key in ('calStartDate', 'today', 'batteryDisplayMode', 'dayOfWeekText', 'weekStartDay',
+                    'maxEventsPerDay', 'is24hour'):
+            calHash.update(repr(calDict[key]).encode('utf-8'))
+        for event in calDict['events']:
+            calHash.update(repr((event['summary'], event['allday'], event['startDatetime'].isoformat(),
+                                 event['endDatetime'].isoformat(), event['isUpdated'],
+                                 event['isMultiday'])).encode('utf-8'))
+        return calHash.hexdigest()
+
+    def get_frame(self, name, frameFormat='fb'):
+        # Returns (etag, body) of a profile's frame as a frame file ('fb') or encoded ('fbz'), rendering it again
+        # only if its inputs changed
+        profile = self.profiles[name]
+        calDict, calDictHash = self.get_cal_dict()
+        with profile['lock']:
+            if profile['calDictHash'] != calDictHash:
+                start = time.perf_counter()
+                with self.renderLock:
+                    profile['calFrame'] = profile['renderService'].process_inputs(calDict)
+                profile['frames'] = {}
+                profile['calDictHash'] = calDictHash
+                self.logger.info('Profile {} rendered in {:.3f}s.'.format(name, time.perf_counter() - start))
+            if frameFormat not in profile['frames']:
+                if frameFormat == 'fbz':
+                    body = encode_frame(profile['calFrame'])
+                else:
+                    body = profile['calFrame'].to_bytes()
+                profile['frames'][frameFormat] = ('"{}"'.format(hashlib.sha256(body).hexdigest()), body)
+            return profile['frames'][frameFormat]
+
+    def get_last_frame(self, name, frameFormat='fb'):
+        # The frame served last, if any, for when rendering fails
+        return self.profiles[name]['frames'].get(frameFormat, (None, None))
+
+    def serve(self, host='', port=8080):
+        httpServer = ThreadingHTTPServer((host, port), FrameRequestHandler)
+        httpServer.renderServer = self
+        self.logger.info('Serving frames of {} on port {}.'.format(', '.join(self.profiles), port))
+        return httpServer
+
+
+class FrameRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        renderServer = self.server.renderServer
+        parts = self.path.split('?')[0].strip('/').split('/')
+        name, frameFormat = parts[-1], 'fb'
+        if name.endswith('.fbz'):
+            name, frameFormat = name[:-4], 'fbz'
+        if len(parts) != 2 or parts[0] != 'frame' or name not in renderServer.profiles:
+            self.send_error(404, 'Unknown frame')
+            return
+        try:
+            etag, frame = renderServer.get_frame(name, frameFormat)
+        except Exception as e:
+            renderServer.logger.error('Rendering profile {} failed: {}'.format(name, e))
+            etag, frame = renderServer.get_last_frame(name, frameFormat)
+            if frame is None:
+                self.send_error(503, 'Frame not available')
+                return
+
+        if self.is_not_modified(etag):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(frame)))
+        self.send_header('ETag', etag)
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+        self.wfile.write(frame)
+
+    def is_not_modified(self, etag):
+        # If-None-Match lists the ETags the client has, or is '*' for any
+        tags = [tag.strip() for tag in self.headers.get('If-None-Match', '').split(',')]
+        return '*' in tags or etag in [tag[2:] if tag.startswith('W/') else tag for tag in tags]
+
+    def log_message(self, format, *args):
+        self.server.renderServer.logger.info('{} - {}'.format(self.address_string(), format % args))
+
+
+def main():
+    configFile = open('config.json')
+    config = json.load(configFile)
+    port = config.get('serverPort', 8080)
+
+    logging.basicConfig(stream=sys.stdout, format='%(asctime)s %(levelname)s - %(message)s')
+    logging.getLogger('maginkcal').setLevel(logging.INFO)
+
+    renderServer = RenderServer(config)
+    httpServer = renderServer.serve(port=port)
+    try:
+        httpServer.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpServer.server_close()
+
+
+if __name__ == "__main__":
+    main()